@@ -0,0 +1,160 @@
+import asyncio
+import functools
+import inspect
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 1000
+DEFAULT_WRITE_WORKERS = 32
+
+# Методы, которые при включенной отложенной записи только кладут строку в буфер
+WRITE_BEHIND_METHODS = frozenset(('add_user', 'add_subscription_request'))
+
+class MethodStats:
+    """Статистика вызовов одного метода базы данных"""
+    __slots__ = ('calls', 'errors', 'wait_total', 'wait_max', 'exec_total', 'exec_max')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.exec_total = 0.0
+        self.exec_max = 0.0
+
+    def record(self, wait: float, execution: float, failed: bool):
+        self.calls += 1
+        if failed:
+            self.errors += 1
+        self.wait_total += wait
+        self.exec_total += execution
+        self.wait_max = max(self.wait_max, wait)
+        self.exec_max = max(self.exec_max, execution)
+
+    def as_dict(self) -> Dict[str, float]:
+        calls = self.calls or 1
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'wait_avg_ms': self.wait_total / calls * 1000,
+            'wait_max_ms': self.wait_max * 1000,
+            'exec_avg_ms': self.exec_total / calls * 1000,
+            'exec_max_ms': self.exec_max * 1000,
+        }
+
+class AsyncDatabase:
+    """Асинхронная обертка над Database.
+
+    Все обращения к SQLite выполняются в отдельном потоке-исполнителе, поэтому
+    цикл событий бота не блокируется на диске. Задания проходят через
+    ограниченную очередь: при ее заполнении вызывающий ждет (backpressure).
+    Любой публичный метод Database доступен как корутина с тем же именем:
+    ``await adb.get_user(user_id)``. Генераторы (iter_*) не доступны: их обход
+    выполнял бы запросы в цикле событий - используйте методы *_page.
+
+    Если у Database включена отложенная запись, add_user и
+    add_subscription_request идут мимо очереди в пул из write_workers потоков:
+    в режиме DURABILITY_COMMIT каждый вызов ждет коммита своей пачки, и через
+    единственный поток базы пачки состояли бы из одной строки.
+    """
+
+    def __init__(self, db: Database, max_queue_size: int = DEFAULT_QUEUE_SIZE,
+                 write_workers: int = DEFAULT_WRITE_WORKERS):
+        self.db = db
+        self.max_queue_size = max_queue_size
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite')
+        self._write_executor = ThreadPoolExecutor(max_workers=write_workers,
+                                                  thread_name_prefix='sqlite-write-behind')
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._stats: Dict[str, MethodStats] = {}
+
+    async def start(self):
+        """Запуск обработчика очереди"""
+        if self._worker is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+            self._worker = asyncio.create_task(self._run(), name='async-database')
+
+    async def close(self):
+        """Дожидается выполнения поставленных заданий и останавливает исполнитель"""
+        if self._worker is not None:
+            await self._queue.put(None)
+            await self._worker
+            self._worker = None
+            self._queue = None
+        self._executor.shutdown(wait=True)
+        self._write_executor.shutdown(wait=True)
+
+    async def call(self, method: str, *args, **kwargs) -> Any:
+        """Выполнение метода Database в потоке базы данных"""
+        func = getattr(self.db, method)
+        if inspect.isgeneratorfunction(func):
+            raise TypeError(f"{method} is a generator, use the paged method instead")
+        if method in WRITE_BEHIND_METHODS and self.db.write_behind:
+            return await self._call_write_behind(method, func, args, kwargs)
+        if self._worker is None:
+            await self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((method, func, args, kwargs, future, time.perf_counter()))
+        return await future
+
+    async def _call_write_behind(self, method: str, func: Callable, args: tuple, kwargs: dict) -> Any:
+        """Вызов в пуле потоков, чтобы одновременные вызовы попали в одну пачку"""
+        started_at = time.perf_counter()
+        failed = False
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._write_executor, functools.partial(func, *args, **kwargs))
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._stats.setdefault(method, MethodStats()).record(
+                0.0, time.perf_counter() - started_at, failed)
+
+    def __getattr__(self, name: str) -> Callable:
+        attr = getattr(Database, name, None)
+        if name.startswith('_') or not callable(attr) or inspect.isgeneratorfunction(attr):
+            raise AttributeError(name)
+        return functools.partial(self.call, name)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                break
+            method, func, args, kwargs, future, enqueued_at = job
+            started_at = time.perf_counter()
+            failed = False
+            try:
+                result = await loop.run_in_executor(
+                    self._executor, functools.partial(func, *args, **kwargs))
+            except Exception as e:
+                failed = True
+                if not future.cancelled():
+                    future.set_exception(e)
+            else:
+                if not future.cancelled():
+                    future.set_result(result)
+            finally:
+                finished_at = time.perf_counter()
+                self._stats.setdefault(method, MethodStats()).record(
+                    started_at - enqueued_at, finished_at - started_at, failed)
+                self._queue.task_done()
+
+    @property
+    def queue_depth(self) -> int:
+        """Количество заданий, ожидающих выполнения"""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        """Время ожидания в очереди и время выполнения по методам"""
+        return {method: stats.as_dict() for method, stats in self._stats.items()}
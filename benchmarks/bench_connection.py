@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк задержки одного вызова Database: новое соединение на каждый
+вызов (как было раньше) против общего соединения с WAL и кэшем выражений.
+
+Использование: python benchmarks/bench_connection.py [--calls 2000]
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+
+
+class PerCallConnectionDatabase(Database):
+    """Database, открывающая новое соединение на каждый вызов (старое поведение)"""
+
+    def _connect(self):
+        return None
+
+    @contextmanager
+    def _transaction(self):
+        with sqlite3.connect(self.db_path) as conn:
+            yield conn.cursor()
+
+    # Чтения без кэша настроек и сводки звезд - прежний SQL
+
+    def get_setting(self, key):
+        with self._transaction() as cursor:
+            cursor.execute('SELECT value FROM settings WHERE key = ?', (key,))
+            result = cursor.fetchone()
+            return result[0] if result else None
+
+    def get_stars_balance(self):
+        with self._transaction() as cursor:
+            cursor.execute('''
+                SELECT SUM(CASE WHEN operation_type = 'add' THEN amount
+                               WHEN operation_type = 'subtract' THEN -amount
+                               ELSE 0 END) as balance
+                FROM stars_balance
+            ''')
+            result = cursor.fetchone()
+            return result[0] if result[0] is not None else 0
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure(db, calls):
+    """Замер задержки основных методов, мкс на вызов"""
+    operations = {
+        'add_user': lambda i: db.add_user(i, f'user{i}', 'First', 'Last'),
+        'get_user': lambda i: db.get_user(i),
+        'get_setting': lambda i: db.get_setting('auto_approval'),
+        'get_stars_balance': lambda i: db.get_stars_balance(),
+        'add_subscription_request': lambda i: db.add_subscription_request(i, f'user{i}'),
+    }
+    results = {}
+    for name, operation in operations.items():
+        samples = []
+        for i in range(calls):
+            started = time.perf_counter()
+            operation(i)
+            samples.append((time.perf_counter() - started) * 1e6)
+        results[name] = (percentile(samples, 50), percentile(samples, 99))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--calls', type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        before = measure(PerCallConnectionDatabase(os.path.join(tmp, 'before.db')), args.calls)
+        after_db = Database(os.path.join(tmp, 'after.db'))
+        after = measure(after_db, args.calls)
+        after_db.close()
+
+    print(f"{'method':<28}{'before p50':>12}{'after p50':>12}{'before p99':>12}{'after p99':>12}  (us)")
+    for name in before:
+        print(f"{name:<28}{before[name][0]:>12.1f}{after[name][0]:>12.1f}"
+              f"{before[name][1]:>12.1f}{after[name][1]:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
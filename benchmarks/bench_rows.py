@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк памяти и времени загрузки строк: dict(zip(columns, row)) на каждую
+строку (как было раньше) против записей на __slots__ (models.Record).
+
+Использование: python benchmarks/bench_rows.py [--rows 100000]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+
+
+def load_as_dicts(db):
+    """Старая реализация get_pending_requests"""
+    with db._transaction() as cursor:
+        cursor.execute('''
+            SELECT * FROM subscription_requests
+            WHERE status = 'pending'
+            ORDER BY created_at ASC
+        ''')
+        rows = cursor.fetchall()
+        columns = [description[0] for description in cursor.description]
+        return [dict(zip(columns, row)) for row in rows]
+
+
+def measure(load):
+    """Пиковая и удерживаемая память (МБ) и время (с) одной загрузки"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = load()
+    elapsed = time.perf_counter() - started
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return retained / 2 ** 20, peak / 2 ** 20, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=100000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'rows.db'))
+        with db._transaction() as cursor:
+            cursor.executemany(
+                'INSERT INTO subscription_requests (user_id, username, first_name, last_name) VALUES (?, ?, ?, ?)',
+                ((i, f'user{i}', 'First', 'Last') for i in range(args.rows)))
+
+        results = {
+            'dict per row': measure(lambda: load_as_dicts(db)),
+            'slots record': measure(db.get_pending_requests),
+        }
+        db.close()
+
+    print(f"{args.rows} rows")
+    print(f"{'loader':<16}{'retained MB':>14}{'peak MB':>10}{'time s':>10}")
+    for name, (retained, peak, elapsed) in results.items():
+        print(f"{name:<16}{retained:>14.1f}{peak:>10.1f}{elapsed:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
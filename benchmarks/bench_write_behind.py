@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк пропускной способности add_user / add_subscription_request:
+транзакция на каждый вызов против отложенной пакетной записи (write-behind).
+Второй сценарий - /start: add_user и сразу get_user того же пользователя;
+чтение не должно дробить пачки, поэтому печатается и число коммитов.
+
+Использование: python benchmarks/bench_write_behind.py [--rows 20000] [--threads 8]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database, DURABILITY_BUFFERED, DURABILITY_COMMIT
+
+
+def run(db, rows, threads):
+    """Запись rows пользователей и заявок из threads потоков, строк в секунду"""
+    def worker(offset):
+        for user_id in range(offset, rows, threads):
+            db.add_user(user_id, f'user{user_id}')
+            db.add_subscription_request(user_id, f'user{user_id}')
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(worker, range(threads)))
+    db.flush()
+    elapsed = time.perf_counter() - started
+    return rows * 2 / elapsed
+
+
+def run_add_then_read(db, rows, threads):
+    """add_user + get_user из threads потоков: (строк в секунду, число коммитов)"""
+    commits = [0]
+
+    def trace(sql):
+        if sql == 'COMMIT':
+            commits[0] += 1
+
+    def worker(offset):
+        for user_id in range(offset, rows, threads):
+            db.add_user(user_id, f'user{user_id}')
+            if db.get_user(user_id) is None:
+                raise RuntimeError(f"user {user_id} is not visible after add_user")
+
+    db._conn.set_trace_callback(trace)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(worker, range(threads)))
+    db.flush()
+    elapsed = time.perf_counter() - started
+    db._conn.set_trace_callback(None)
+    return rows / elapsed, commits[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    modes = {
+        'per-call': {},
+        'write-behind (commit)': {'write_behind': True, 'durability': DURABILITY_COMMIT},
+        'write-behind (buffered)': {'write_behind': True, 'durability': DURABILITY_BUFFERED},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, options in modes.items():
+            db = Database(os.path.join(tmp, f'{len(name)}.db'), **options)
+            rate = run(db, args.rows, args.threads)
+            pending = len(db.get_pending_requests())
+            db.close()
+            print(f"{name:<26}{rate:>12.0f} rows/s  ({pending} requests stored)")
+        print('add_user + get_user:')
+        for name, options in modes.items():
+            db = Database(os.path.join(tmp, f'read-{len(name)}.db'), **options)
+            rate, commits = run_add_then_read(db, args.rows, args.threads)
+            db.close()
+            print(f"{name:<26}{rate:>12.0f} rows/s  ({commits} commits)")
+
+
+if __name__ == '__main__':
+    main()
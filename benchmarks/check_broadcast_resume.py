@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Проверка продолжения рассылки после остановки против поддельного Bot API.
+
+Запускает рассылку на --users пользователей, останавливает BroadcastRunner
+и планировщик посреди задания (как при передеплое), затем новым раннером
+вызывает resume_all() и дожидается конца. Проверяется, что каждый
+получатель получил сообщение, повторно ушло не больше одной пачки, а
+sent / failed / last_user_id задания совпадают с ответами API.
+
+Использование: python benchmarks/check_broadcast_resume.py [--users 600] [--batch-size 50]
+Код выхода 1, если хотя бы одна проверка не прошла.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from async_database import AsyncDatabase
+from broadcast import BroadcastRunner
+from database import Database
+from fake_bot_api import FakeBotAPI
+from sender import MessageScheduler
+
+ADMIN_ID = 1
+
+
+def create_scheduler(bot):
+    # У поддельного API нет лимитов Telegram
+    scheduler = MessageScheduler(bot, workers=16, global_rate=10 ** 6, per_chat_rate=10 ** 6)
+    scheduler.start()
+    return scheduler
+
+
+async def wait_for(predicate, timeout=60.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not await predicate():
+        if asyncio.get_running_loop().time() > deadline:
+            raise TimeoutError('condition not reached')
+        await asyncio.sleep(0.01)
+
+
+async def check(users, batch_size, tmp):
+    blocked = {user_id for user_id in range(1, users + 1) if user_id % 25 == 0}
+    api = FakeBotAPI(latency_ms=2, blocked_predicate=blocked.__contains__)
+    await api.start()
+    bot = api.create_bot()
+    db = AsyncDatabase(Database(os.path.join(tmp, 'broadcast.db')))
+    for user_id in range(1, users + 1):
+        await db.add_user(user_id, f'user{user_id}')
+
+    # Первый запуск: останавливаем, когда отправлена примерно треть
+    scheduler = create_scheduler(bot)
+    runner = BroadcastRunner(db, scheduler, batch_size=batch_size)
+    job_id = await runner.create('Проверка рассылки', ADMIN_ID)
+
+    async def third_sent():
+        return api.calls['sendmessage'] >= users // 3
+
+    await wait_for(third_sent)
+    await runner.close()
+    await scheduler.close(drain=False)
+    stopped = await db.get_broadcast(job_id)
+    print(f"stopped after user {stopped.last_user_id}: sent {stopped.sent}, failed {stopped.failed}")
+
+    # Перезапуск: новый планировщик и раннер продолжают с сохраненной позиции
+    scheduler = create_scheduler(bot)
+    runner = BroadcastRunner(db, scheduler, batch_size=batch_size)
+    resumed = await runner.resume_all()
+
+    async def finished():
+        return (await db.get_broadcast(job_id)).status == 'done'
+
+    await wait_for(finished)
+    job = await db.get_broadcast(job_id)
+    await runner.close()
+    await scheduler.close()
+    await db.close()
+    await bot.session.close()
+    await api.stop()
+
+    recipients = set(range(1, users + 1)) - blocked
+    delivered = set(api.messages)
+    duplicates = [user_id for user_id, count in api.messages.items() if count > 1]
+    checks = {
+        'one job resumed': resumed == 1,
+        'stopped mid-job': 0 < stopped.last_user_id < users,
+        'every recipient got the message': recipients <= delivered,
+        # Повторно уходит только пачка, прерванная до сохранения позиции
+        f'at most one batch sent twice ({len(duplicates)} duplicates)': all(
+            stopped.last_user_id < user_id <= stopped.last_user_id + batch_size for user_id in duplicates),
+        f'sent == {len(recipients)} ({job.sent})': job.sent == len(recipients),
+        f'failed == {len(blocked)} ({job.failed})': job.failed == len(blocked),
+        f'last_user_id == {users} ({job.last_user_id})': job.last_user_id == users,
+        f'total == {users} ({job.total})': job.total == users,
+    }
+    for name, ok in checks.items():
+        print(f"{'OK ' if ok else 'FAIL'} {name}")
+    return all(checks.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=600)
+    parser.add_argument('--batch-size', type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ok = asyncio.run(check(args.users, args.batch_size, tmp))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Проверка того, что горячие запросы Database используют индексы
+(EXPLAIN QUERY PLAN не должен содержать полного сканирования таблицы).
+
+Использование: python benchmarks/check_query_plans.py
+Код выхода 1, если хотя бы один запрос сканирует таблицу целиком.
+"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import (
+    Database, GET_USER_SQL, PENDING_REQUESTS_SQL, COUNT_PENDING_REQUESTS_SQL, GIFTS_SENT_SQL,
+    FAIL_EXPIRED_GIFT_JOBS_SQL, CLAIM_EXPIRED_GIFT_JOBS_SQL, CLAIM_PENDING_GIFT_JOBS_SQL,
+    ARCHIVABLE_REQUESTS_SQL,
+    PENDING_REQUESTS_PAGE, GIFTS_SENT_PAGE, page_sql, user_ids_page_sql,
+)
+from models import SubscriptionRequest, LedgerEntry
+
+# Те же строки SQL, что выполняют методы Database
+HOT_QUERIES = {
+    'get_user': (GET_USER_SQL, (1,)),
+    'get_pending_requests': (PENDING_REQUESTS_SQL, ()),
+    'count_pending_requests': (COUNT_PENDING_REQUESTS_SQL, ()),
+    'get_gifts_sent': (GIFTS_SENT_SQL, ()),
+    'requests_by_user': ('SELECT id FROM subscription_requests WHERE user_id = ?', (1,)),
+    'ledger_by_user': ('SELECT id FROM stars_balance WHERE user_id = ?', (1,)),
+    'fail_expired_gift_jobs': (FAIL_EXPIRED_GIFT_JOBS_SQL, ('9999', '9999', '9999', 5)),
+    'claim_expired_gift_jobs': (CLAIM_EXPIRED_GIFT_JOBS_SQL, ('9999', 10)),
+    'claim_pending_gift_jobs': (CLAIM_PENDING_GIFT_JOBS_SQL, ('9999', 10)),
+    'archive_requests': (ARCHIVABLE_REQUESTS_SQL, ('-30 days', '-30 days', 500)),
+    'get_user_ids_page': (user_ids_page_sql(), (0, 500)),
+    'get_user_ids_page(filtered)': (user_ids_page_sql(True, True), (0, True, False, 500)),
+}
+for name, record, (table, where, descending) in (
+        ('pending_requests_page', SubscriptionRequest, PENDING_REQUESTS_PAGE),
+        ('gifts_sent_page', LedgerEntry, GIFTS_SENT_PAGE)):
+    for direction, scan_descending in (('next', descending), ('prev', not descending)):
+        HOT_QUERIES[f'{name}({direction}, first)'] = (
+            page_sql(record, table, where, scan_descending, False), (21,))
+        HOT_QUERIES[f'{name}({direction})'] = (
+            page_sql(record, table, where, scan_descending, True), ('2024-01-01 00:00:00', 1, 21))
+
+
+def uses_index(plan):
+    """Запрос не сканирует таблицу целиком и не сортирует во временном B-дереве"""
+    return not any(
+        (step.startswith('SCAN') and 'USING' not in step) or 'TEMP B-TREE' in step
+        for step in plan
+    )
+
+
+def main():
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'plans.db'))
+        for name, (sql, params) in HOT_QUERIES.items():
+            plan = db.explain_query_plan(sql, params)
+            ok = uses_index(plan)
+            failed |= not ok
+            print(f"{'OK ' if ok else 'FAIL'} {name}: {'; '.join(plan)}")
+        db.close()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
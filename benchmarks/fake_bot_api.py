@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Локальный поддельный Bot API для бенчмарков и ручных проверок.
+
+Отвечает на getMe, sendMessage, sendSticker, getChatMember, setWebhook и
+deleteWebhook правдоподобными ответами с настраиваемой задержкой; раз в
+flood_every запросов может вернуть 429 с retry_after. Отправка в чаты из
+blocked_predicate отвечает 403 (бот заблокирован). Все вызовы считаются,
+sendMessage - еще и по каждому чату (messages).
+
+Использование в коде:
+    server = FakeBotAPI(latency_ms=20)
+    await server.start()
+    bot = server.create_bot()
+"""
+
+import argparse
+import asyncio
+import itertools
+import time
+from collections import Counter
+
+from aiohttp import web
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+TOKEN = '123456:fake-token'
+
+
+class FakeBotAPI:
+    def __init__(self, host='127.0.0.1', port=8093, latency_ms=0.0, flood_every=0,
+                 retry_after=1, member_predicate=None, blocked_predicate=None):
+        self.host = host
+        self.port = port
+        self.latency = latency_ms / 1000
+        self.flood_every = flood_every
+        self.retry_after = retry_after
+        # По умолчанию подписаны пользователи с нечетным id
+        self.member_predicate = member_predicate or (lambda user_id: user_id % 2 == 1)
+        self.blocked_predicate = blocked_predicate or (lambda chat_id: False)
+        self.calls = Counter()
+        self.messages = Counter()
+        self._requests = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._runner = None
+
+    @property
+    def base_url(self):
+        return f'http://{self.host}:{self.port}'
+
+    def create_bot(self, token=TOKEN):
+        session = AiohttpSession(api=TelegramAPIServer.from_base(self.base_url))
+        return Bot(token, session=session)
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route('*', '/bot{token}/{method}', self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _params(self, request):
+        if request.content_type.startswith('multipart/') or request.content_type.endswith('urlencoded'):
+            return dict(await request.post())
+        if request.can_read_body:
+            return await request.json()
+        return dict(request.query)
+
+    async def _handle(self, request):
+        method = request.match_info['method'].lower()
+        params = await self._params(request)
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.flood_every and next(self._requests) % self.flood_every == 0:
+            return web.json_response({
+                'ok': False, 'error_code': 429,
+                'description': f'Too Many Requests: retry after {self.retry_after}',
+                'parameters': {'retry_after': self.retry_after},
+            }, status=429)
+        if method.startswith('send') and self.blocked_predicate(int(params['chat_id'])):
+            return web.json_response({
+                'ok': False, 'error_code': 403, 'description': 'Forbidden: bot was blocked by the user',
+            }, status=403)
+        handler = getattr(self, f'_{method}', None)
+        if handler is None:
+            return web.json_response({'ok': True, 'result': True})
+        return web.json_response({'ok': True, 'result': handler(params)})
+
+    def _getme(self, params):
+        return {'id': 123456, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot'}
+
+    def _message(self, params):
+        chat_id = int(params['chat_id'])
+        return {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+        }
+
+    def _sendmessage(self, params):
+        message = self._message(params)
+        message['text'] = params.get('text', '')
+        self.messages[message['chat']['id']] += 1
+        return message
+
+    def _sendsticker(self, params):
+        message = self._message(params)
+        message['sticker'] = {
+            'file_id': str(params.get('sticker')), 'file_unique_id': 'fake', 'type': 'regular',
+            'width': 512, 'height': 512, 'is_animated': False, 'is_video': False,
+        }
+        return message
+
+    def _getchatmember(self, params):
+        user_id = int(params['user_id'])
+        user = {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}'}
+        if self.member_predicate(user_id):
+            return {'status': 'member', 'user': user}
+        return {'status': 'left', 'user': user}
+
+
+async def _serve(args):
+    server = FakeBotAPI(args.host, args.port, args.latency_ms, args.flood_every)
+    await server.start()
+    print(f'Fake Bot API on {server.base_url} (token {TOKEN})')
+    await asyncio.Event().wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8093)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--flood-every', type=int, default=0)
+    asyncio.run(_serve(parser.parse_args()))
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест режима вебхука: локальный сервер webhook.create_app и
+синтетические Update, отправляемые POST-запросами с заданной параллельностью.
+Обработчик сообщений имитирует работу задержкой --work-ms и не обращается к Bot API.
+
+Использование: python benchmarks/loadtest_webhook.py [--updates 5000] [--concurrency 100]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import ClientSession, web
+from aiogram import Bot, Dispatcher, F
+from aiogram.types import Message
+
+from webhook import SECRET_HEADER, create_app
+
+SECRET = 'loadtest-secret'
+
+
+def make_update(update_id):
+    user_id = 100000 + update_id % 1000
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Load'},
+            'text': '/start',
+        },
+    }
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))] if ordered else 0.0
+
+
+async def main(args):
+    dispatcher = Dispatcher()
+
+    @dispatcher.message(F.text)
+    async def on_message(message: Message):
+        await asyncio.sleep(args.work_ms / 1000)
+
+    bot = Bot('123456:loadtest')
+    app = create_app(dispatcher, bot, secret_token=SECRET)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', args.port)
+    await site.start()
+    handler = app['update_handler']
+
+    ack_latencies = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+    url = f'http://127.0.0.1:{args.port}/webhook'
+
+    async with ClientSession() as session:
+        async def post(update_id):
+            async with semaphore:
+                started = time.perf_counter()
+                async with session.post(url, json=make_update(update_id),
+                                        headers={SECRET_HEADER: SECRET}) as response:
+                    await response.read()
+                    ack_latencies.append(time.perf_counter() - started)
+                    return response.status
+
+        started = time.perf_counter()
+        statuses = await asyncio.gather(*(post(i) for i in range(1, args.updates + 1)))
+        acked = time.perf_counter() - started
+        await handler.join()
+        handled = time.perf_counter() - started
+
+    metrics = handler.get_metrics()
+    await runner.cleanup()
+    await bot.session.close()
+
+    print(f"updates: {args.updates}, concurrency: {args.concurrency}, handler work: {args.work_ms} ms")
+    print(f"HTTP 200: {statuses.count(200)}, 503 (queue full): {statuses.count(503)}")
+    print(f"ack throughput:     {args.updates / acked:10.0f} updates/s")
+    print(f"handled throughput: {metrics['handled'] / handled:10.0f} updates/s")
+    print(f"ack latency p50/p99:     {percentile(ack_latencies, 50) * 1000:7.2f} / "
+          f"{percentile(ack_latencies, 99) * 1000:7.2f} ms")
+    print(f"handler latency p50/p99: {metrics['latency_p50_ms']:7.2f} / {metrics['latency_p99_ms']:7.2f} ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--updates', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--work-ms', type=float, default=5.0)
+    parser.add_argument('--port', type=int, default=8089)
+    asyncio.run(main(parser.parse_args()))
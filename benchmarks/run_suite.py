@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Набор бенчмарков Database и сценария бота.
+
+1. Заполняет базу синтетическими пользователями, заявками и операциями
+   журнала звезд в каждом из масштабов --scales.
+2. Замеряет каждый метод Database в одном потоке и из --threads потоков.
+3. Прогоняет сценарий /start -> /subscribe -> одобрение -> /gift_sent для
+   --flow-users пользователей против локального поддельного Bot API.
+
+Результат - JSON (--output) с пропускной способностью и p50/p99 для каждого
+замера. --compare previous.json печатает изменение относительно прошлого прогона.
+
+Использование:
+    python benchmarks/run_suite.py --scales 10000,100000 --output report.json
+    python benchmarks/run_suite.py --scales 10000,100000,1000000 --compare report.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from async_database import AsyncDatabase
+from database import Database
+from fake_bot_api import FakeBotAPI
+from membership import MembershipCache
+from sender import MessageScheduler, PRIORITY_ADMIN
+
+ADMIN_ID = 1
+CHANNEL_ID = -1000000000001
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))] if ordered else 0.0
+
+
+def summarize(samples, elapsed):
+    return {
+        'calls': len(samples),
+        'ops_per_sec': len(samples) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000,
+    }
+
+
+def seed(db_path, scale):
+    """Синтетические данные: scale пользователей, заявок и операций журнала"""
+    started = time.perf_counter()
+    rng = random.Random(scale)
+    base = datetime(2024, 1, 1)
+    Database(db_path).close()
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.executemany(
+            'INSERT INTO users (user_id, username, first_name, is_subscribed, gift_sent, created_at) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            ((user_id, f'user{user_id}', 'Seed', user_id % 2, user_id % 4 == 1,
+              base + timedelta(seconds=user_id)) for user_id in range(1, scale + 1)))
+        conn.executemany(
+            'INSERT INTO subscription_requests (user_id, username, status, created_at) VALUES (?, ?, ?, ?)',
+            ((user_id, f'user{user_id}', 'pending' if user_id % 10 == 0 else 'approved',
+              (base + timedelta(seconds=user_id)).strftime('%Y-%m-%d %H:%M:%S'))
+             for user_id in range(1, scale + 1)))
+        conn.executemany(
+            'INSERT INTO stars_balance (amount, operation_type, description, user_id, gift_type, created_at) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            ((rng.randint(1, 5), op, 'seed', user_id, 'telegram_gift' if op == 'gift_sent' else None,
+              (base + timedelta(seconds=user_id)).strftime('%Y-%m-%d %H:%M:%S'))
+             for user_id in range(1, scale + 1)
+             for op in (('add', 'subtract', 'gift_sent')[user_id % 3],)))
+    conn.close()
+    db = Database(db_path)
+    db.reconcile()
+    db.close()
+    return time.perf_counter() - started
+
+
+def method_cases(scale):
+    """(имя, функция(db, rng), количество вызовов) для каждого метода Database"""
+    heavy = max(3, 200000 // scale)
+    pending_ids = lambda rng: rng.randrange(1, scale // 10 + 1) * 10
+    user = lambda rng: rng.randint(1, scale)
+    new_user = lambda rng: scale + rng.randint(1, 10 ** 9)
+    return [
+        ('get_user', lambda db, rng: db.get_user(user(rng)), 2000),
+        ('add_user', lambda db, rng: db.add_user(new_user(rng), 'bench'), 1000),
+        ('update_user_subscription', lambda db, rng: db.update_user_subscription(user(rng), True), 1000),
+        ('mark_gift_sent', lambda db, rng: db.mark_gift_sent(user(rng)), 1000),
+        ('add_subscription_request', lambda db, rng: db.add_subscription_request(new_user(rng)), 1000),
+        ('get_pending_requests', lambda db, rng: db.get_pending_requests(), heavy),
+        ('get_pending_requests_page', lambda db, rng: db.get_pending_requests_page(), 1000),
+        ('count_pending_requests', lambda db, rng: db.count_pending_requests(), 200),
+        ('process_subscription_request',
+         lambda db, rng: db.process_subscription_request(pending_ids(rng), 'approved', ADMIN_ID), 1000),
+        ('get_stars_balance', lambda db, rng: db.get_stars_balance(), 2000),
+        ('add_stars', lambda db, rng: db.add_stars(1, 'bench'), 1000),
+        ('subtract_stars', lambda db, rng: db.subtract_stars(1, 'bench'), 1000),
+        ('send_gift_stars', lambda db, rng: db.send_gift_stars(user(rng), 1), 1000),
+        ('get_gifts_sent', lambda db, rng: db.get_gifts_sent(), heavy),
+        ('get_gifts_sent_page', lambda db, rng: db.get_gifts_sent_page(), 1000),
+        ('get_total_gifts_sent', lambda db, rng: db.get_total_gifts_sent(), 2000),
+        ('get_total_stars_spent_on_gifts', lambda db, rng: db.get_total_stars_spent_on_gifts(), 2000),
+        ('get_setting', lambda db, rng: db.get_setting('gift_message'), 2000),
+        ('get_auto_approval_status', lambda db, rng: db.get_auto_approval_status(), 2000),
+        ('set_setting', lambda db, rng: db.set_setting('bench', str(rng.random())), 500),
+        ('get_user_ids_page', lambda db, rng: db.get_user_ids_page(user(rng), 100, is_subscribed=True), 1000),
+        ('get_dashboard_snapshot', lambda db, rng: db.get_dashboard_snapshot(force=True), heavy),
+        ('get_daily_stats', lambda db, rng: db.get_daily_stats(), 1000),
+    ]
+
+
+def run_single(db, func, calls):
+    rng = random.Random(1)
+    samples = []
+    started = time.perf_counter()
+    for _ in range(calls):
+        call_started = time.perf_counter()
+        func(db, rng)
+        samples.append(time.perf_counter() - call_started)
+    return summarize(samples, time.perf_counter() - started)
+
+
+def run_concurrent(db, func, calls, threads):
+    def worker(seed_value):
+        rng = random.Random(seed_value)
+        samples = []
+        for _ in range(max(1, calls // threads)):
+            call_started = time.perf_counter()
+            func(db, rng)
+            samples.append(time.perf_counter() - call_started)
+        return samples
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(worker, range(threads)))
+    return summarize([sample for samples in results for sample in samples], time.perf_counter() - started)
+
+
+def bench_methods(scale, threads, tmp):
+    db_path = os.path.join(tmp, f'bench_{scale}.db')
+    seed_seconds = seed(db_path, scale)
+    print(f'scale {scale}: seeded in {seed_seconds:.1f}s', flush=True)
+    results = []
+    db = Database(db_path)
+    for name, func, calls in method_cases(scale):
+        for mode, runner in (('single', lambda: run_single(db, func, calls)),
+                             ('concurrent', lambda: run_concurrent(db, func, calls, threads))):
+            result = dict(scale=scale, method=name, mode=mode, **runner())
+            results.append(result)
+            print(f"  {name:<32}{mode:<11}{result['ops_per_sec']:>11.0f} ops/s"
+                  f"  p50 {result['p50_ms']:8.3f} ms  p99 {result['p99_ms']:8.3f} ms", flush=True)
+    db.close()
+    os.remove(db_path)
+    return results, seed_seconds
+
+
+async def bench_flow(users, concurrency, api_latency_ms, tmp):
+    """Сценарий /start -> /subscribe -> одобрение -> /gift_sent против поддельного Bot API"""
+    api = FakeBotAPI(latency_ms=api_latency_ms, member_predicate=lambda user_id: True)
+    await api.start()
+    bot = api.create_bot()
+    db = AsyncDatabase(Database(os.path.join(tmp, 'flow.db')))
+    # У поддельного API нет лимитов Telegram - проверяем накладные расходы самого бота
+    scheduler = MessageScheduler(bot, workers=32, global_rate=10 ** 6, per_chat_rate=10 ** 6,
+                                 digest_window=0.05)
+    membership = MembershipCache(bot, CHANNEL_ID)
+    semaphore = asyncio.Semaphore(concurrency)
+    stages = {'start': [], 'subscribe': [], 'approve': [], 'gift_sent': []}
+
+    async def flow(user_id):
+        async with semaphore:
+            started = time.perf_counter()
+            await db.add_user(user_id, f'user{user_id}', 'Flow')
+            await scheduler.send_message(user_id, 'Привет! Подпишитесь на канал.')
+            stages['start'].append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            if await membership.is_member(user_id):
+                request_id = await db.add_subscription_request(user_id, f'user{user_id}')
+                scheduler.notify(ADMIN_ID, f'Новая заявка #{request_id} от {user_id}')
+            stages['subscribe'].append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            await db.process_subscription_request(request_id, 'approved', ADMIN_ID)
+            await scheduler.send_message(user_id, await db.get_setting('gift_message'))
+            scheduler.notify(ADMIN_ID, f'🎁 НУЖНО ОТПРАВИТЬ ПОДАРОК! {user_id}')
+            stages['approve'].append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            await db.send_gift_stars(user_id, 1)
+            await db.mark_gift_sent(user_id)
+            await scheduler.send_message(ADMIN_ID, f'Подарок {user_id} отмечен', priority=PRIORITY_ADMIN)
+            stages['gift_sent'].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(flow(user_id) for user_id in range(1, users + 1)))
+    elapsed = time.perf_counter() - started
+    await scheduler.close()
+    await db.close()
+    await bot.session.close()
+    await api.stop()
+
+    report = {
+        'users': users,
+        'concurrency': concurrency,
+        'api_latency_ms': api_latency_ms,
+        'flows_per_sec': users / elapsed,
+        'api_calls': dict(api.calls),
+        'sender': scheduler.get_metrics(),
+        'database': db.get_stats(),
+        'stages': {name: summarize(samples, elapsed) for name, samples in stages.items()},
+    }
+    print(f"flow: {report['flows_per_sec']:.0f} flows/s")
+    for name, stage in report['stages'].items():
+        print(f"  {name:<12} p50 {stage['p50_ms']:8.2f} ms  p99 {stage['p99_ms']:8.2f} ms")
+    return report
+
+
+def compare(report, previous_path):
+    """Изменение ops/s и p99 относительно прошлого отчета"""
+    with open(previous_path, encoding='utf-8') as f:
+        previous = json.load(f)
+    before = {(r['scale'], r['method'], r['mode']): r for r in previous.get('methods', [])}
+    print(f"\nchange vs {previous_path}:")
+    for result in report['methods']:
+        old = before.get((result['scale'], result['method'], result['mode']))
+        if not old or not old['ops_per_sec'] or not old['p99_ms']:
+            continue
+        print(f"  {result['scale']:>8} {result['method']:<32}{result['mode']:<11}"
+              f"ops/s {result['ops_per_sec'] / old['ops_per_sec'] - 1:+7.1%}"
+              f"  p99 {result['p99_ms'] / old['p99_ms'] - 1:+7.1%}")
+    if 'flow' in previous and 'flow' in report:
+        old, new = previous['flow']['flows_per_sec'], report['flow']['flows_per_sec']
+        print(f"  flow flows/s {new / old - 1:+7.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', default='10000,100000')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--flow-users', type=int, default=2000)
+    parser.add_argument('--flow-concurrency', type=int, default=200)
+    parser.add_argument('--api-latency-ms', type=float, default=5.0)
+    parser.add_argument('--skip-flow', action='store_true')
+    parser.add_argument('--output', default='bench_report.json')
+    parser.add_argument('--compare')
+    args = parser.parse_args()
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'threads': args.threads,
+        },
+        'seed_seconds': {},
+        'methods': [],
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale in (int(value) for value in args.scales.split(',')):
+            results, seed_seconds = bench_methods(scale, args.threads, tmp)
+            report['methods'].extend(results)
+            report['seed_seconds'][str(scale)] = seed_seconds
+        if not args.skip_flow:
+            report['flow'] = asyncio.run(
+                bench_flow(args.flow_users, args.flow_concurrency, args.api_latency_ms, tmp))
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f'report written to {args.output}')
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Optional
+
+from async_database import AsyncDatabase
+from models import BroadcastJob
+from sender import MessageScheduler, PRIORITY_BULK
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 100
+
+class _Progress:
+    """Скорость рассылки в текущем процессе (для оценки ETA)"""
+    __slots__ = ('started_at', 'processed')
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.processed = 0
+
+class BroadcastRunner:
+    """Выполнение рассылок из таблицы broadcast_jobs.
+
+    Получатели читаются из users пачками по возрастанию user_id, сообщения
+    отправляются через MessageScheduler в приоритете рассылок (его ограничения
+    скорости общие с остальным ботом). После каждой пачки позиция сохраняется
+    в базе, поэтому после падения или передеплоя рассылка продолжается с места
+    остановки; повторно может уйти не больше одной пачки.
+    """
+
+    def __init__(self, db: AsyncDatabase, scheduler: MessageScheduler,
+                 batch_size: int = DEFAULT_BATCH_SIZE):
+        self.db = db
+        self.scheduler = scheduler
+        self.batch_size = batch_size
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._progress: Dict[int, _Progress] = {}
+
+    async def create(self, text: str, created_by: int, is_subscribed: Optional[bool] = None,
+                     gift_sent: Optional[bool] = None) -> int:
+        """Создание и запуск рассылки"""
+        job_id = await self.db.create_broadcast(text, created_by, is_subscribed, gift_sent)
+        if job_id:
+            self.start(job_id)
+        return job_id
+
+    def start(self, job_id: int):
+        if job_id not in self._tasks:
+            self._tasks[job_id] = asyncio.create_task(self._run(job_id), name=f'broadcast-{job_id}')
+
+    async def resume_all(self) -> int:
+        """Продолжение незавершенных рассылок (вызывать при старте бота)"""
+        jobs = await self.db.get_active_broadcasts()
+        for job in jobs:
+            logger.info(f"Resuming broadcast {job.id} after user {job.last_user_id}")
+            self.start(job.id)
+        return len(jobs)
+
+    async def cancel(self, job_id: int):
+        task = self._tasks.pop(job_id, None)
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await self.db.set_broadcast_status(job_id, 'cancelled')
+
+    async def close(self):
+        """Остановка без смены статуса - рассылки продолжатся при следующем запуске"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def _send(self, user_id: int, text: str) -> bool:
+        try:
+            await self.scheduler.send_message(user_id, text, priority=PRIORITY_BULK)
+            return True
+        except Exception as e:
+            # Пользователь заблокировал бота, удалил аккаунт и т.п.
+            logger.debug(f"Broadcast message to {user_id} failed: {e}")
+            return False
+
+    async def _run(self, job_id: int):
+        try:
+            job = await self.db.get_broadcast(job_id)
+            if job is None or job.status not in ('pending', 'running'):
+                return
+            await self.db.set_broadcast_status(job_id, 'running')
+            progress = self._progress[job_id] = _Progress()
+            after_user_id = job.last_user_id
+            while True:
+                user_ids = await self.db.get_user_ids_page(
+                    after_user_id, self.batch_size, job.is_subscribed, job.gift_sent)
+                if not user_ids:
+                    break
+                results = await asyncio.gather(*(self._send(user_id, job.text) for user_id in user_ids))
+                sent = sum(results)
+                after_user_id = user_ids[-1]
+                await self.db.update_broadcast_progress(job_id, after_user_id, sent, len(results) - sent)
+                progress.processed += len(results)
+            await self.db.set_broadcast_status(job_id, 'done')
+            logger.info(f"Broadcast {job_id} finished")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Broadcast {job_id} stopped with error: {e}")
+        finally:
+            self._tasks.pop(job_id, None)
+
+    async def get_progress(self, job_id: int) -> Optional[Dict]:
+        """Прогресс рассылки: отправлено, ошибки, скорость и оценка времени до конца"""
+        job: Optional[BroadcastJob] = await self.db.get_broadcast(job_id)
+        if job is None:
+            return None
+        processed = job.sent + job.failed
+        remaining = max(job.total - processed, 0)
+        progress = self._progress.get(job_id)
+        rate = 0.0
+        if progress is not None and progress.processed:
+            rate = progress.processed / max(time.monotonic() - progress.started_at, 1e-6)
+        return {
+            'id': job.id,
+            'status': job.status,
+            'total': job.total,
+            'sent': job.sent,
+            'failed': job.failed,
+            'remaining': remaining,
+            'rate_per_second': rate,
+            'eta_seconds': remaining / rate if rate and job.status == 'running' else None,
+        }
+
+    async def format_progress(self, job_id: int) -> str:
+        """Текст прогресса для админ панели"""
+        progress = await self.get_progress(job_id)
+        if progress is None:
+            return f"❌ Рассылка #{job_id} не найдена"
+        eta = progress['eta_seconds']
+        eta_text = f"{int(eta // 60)} мин {int(eta % 60)} сек" if eta is not None else "—"
+        return (
+            f"📢 Рассылка #{progress['id']} ({progress['status']})\n"
+            f"✅ Отправлено: {progress['sent']} из {progress['total']}\n"
+            f"❌ Ошибок: {progress['failed']}\n"
+            f"⚡ Скорость: {progress['rate_per_second']:.1f} сообщ./сек\n"
+            f"⏳ Осталось: {eta_text}"
+        )
@@ -1,81 +1,692 @@
 import sqlite3
 import logging
-from datetime import datetime
-from typing import List, Dict, Optional, Tuple
+import atexit
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import List, Dict, Optional, Tuple, Iterator, NamedTuple
+
+from models import Record, User, SubscriptionRequest, LedgerEntry, BroadcastJob, DailyStats, GiftJob
 
 logger = logging.getLogger(__name__)
 
+# Параметры соединения по умолчанию
+DEFAULT_CACHE_SIZE_KB = 16 * 1024          # размер страничного кэша SQLite
+DEFAULT_MMAP_SIZE = 64 * 1024 * 1024       # отображение файла БД в память
+DEFAULT_BUSY_TIMEOUT_MS = 5000             # ожидание блокировки другим процессом
+DEFAULT_CACHED_STATEMENTS = 256            # кэш подготовленных выражений
+DEFAULT_DASHBOARD_TTL = 5.0                # время жизни кэша сводки для админ панели, секунды
+DEFAULT_DASHBOARD_DAYS = 30                # дней истории в сводке
+DEFAULT_VACUUM_PAGES = 256                 # страниц за один шаг incremental_vacuum
+AUTO_VACUUM_INCREMENTAL = 2                # значение PRAGMA auto_vacuum для INCREMENTAL
+
+# Баланс, число подарков и звезды на подарки по строкам журнала stars_balance
+LEDGER_SUMS = '''
+    COALESCE(SUM(CASE WHEN operation_type = 'add' THEN amount
+                      WHEN operation_type = 'subtract' THEN -amount
+                      ELSE 0 END), 0) AS balance,
+    COALESCE(SUM(CASE WHEN operation_type = 'gift_sent' THEN 1 ELSE 0 END), 0) AS gifts_sent,
+    COALESCE(SUM(CASE WHEN operation_type = 'gift_sent' THEN amount ELSE 0 END), 0) AS gift_stars_spent
+'''
+
+# Агрегаты по всему журналу: оставшиеся строки плюс контрольные точки сжатых отрезков
+# (используется при сверке)
+LEDGER_TOTALS_SQL = f'''
+    SELECT ledger.balance + checkpoints.balance,
+           ledger.gifts_sent + checkpoints.gifts_sent,
+           ledger.gift_stars_spent + checkpoints.gift_stars_spent
+    FROM (SELECT {LEDGER_SUMS} FROM stars_balance) AS ledger,
+         (SELECT COALESCE(SUM(balance), 0) AS balance, COALESCE(SUM(gifts_sent), 0) AS gifts_sent,
+                 COALESCE(SUM(gift_stars_spent), 0) AS gift_stars_spent
+          FROM ledger_checkpoints) AS checkpoints
+'''
+
+# Число пользователей, подписчиков и ожидающих подарка по строкам users
+USER_SUMS = '''
+    COUNT(*) AS total_users,
+    COALESCE(SUM(is_subscribed), 0) AS subscribed_users,
+    COALESCE(SUM(is_subscribed AND NOT gift_sent), 0) AS awaiting_gift
+'''
+
+# Миграции схемы: (версия, описание, SQL-выражения).
+# Текущая версия хранится в PRAGMA user_version; новые миграции только дописываются в конец.
+MIGRATIONS: List[Tuple[int, str, List[str]]] = [
+    (1, 'base schema', [
+        # Таблица пользователей
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            subscribed_at TIMESTAMP,
+            is_subscribed BOOLEAN DEFAULT FALSE,
+            gift_sent BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        # Таблица заявок на подписку
+        '''
+        CREATE TABLE IF NOT EXISTS subscription_requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            status TEXT DEFAULT 'pending', -- pending, approved, rejected
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            processed_at TIMESTAMP,
+            processed_by INTEGER,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        ''',
+        # Таблица звезд (баланс бота) - реальные Telegram Stars
+        '''
+        CREATE TABLE IF NOT EXISTS stars_balance (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            amount INTEGER,
+            operation_type TEXT, -- add, subtract, gift_sent
+            description TEXT,
+            user_id INTEGER, -- ID пользователя для подарков
+            gift_type TEXT, -- тип подарка
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        # Сводка по журналу звезд (одна строка), обновляется вместе с журналом
+        '''
+        CREATE TABLE IF NOT EXISTS stars_summary (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            balance INTEGER NOT NULL DEFAULT 0,
+            gifts_sent INTEGER NOT NULL DEFAULT 0,
+            gift_stars_spent INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        # Таблица настроек
+        '''
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    (2, 'hot-path indexes', [
+        # get_pending_requests: WHERE status = ? ORDER BY created_at
+        'CREATE INDEX IF NOT EXISTS idx_requests_status_created ON subscription_requests (status, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_requests_user ON subscription_requests (user_id)',
+        # get_gifts_sent: WHERE operation_type = ? ORDER BY created_at
+        'CREATE INDEX IF NOT EXISTS idx_stars_operation_created ON stars_balance (operation_type, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_stars_user ON stars_balance (user_id)',
+    ]),
+    (3, 'broadcast jobs', [
+        # Задания рассылки; last_user_id - позиция курсора для продолжения после перезапуска
+        '''
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            is_subscribed BOOLEAN, -- фильтр получателей, NULL - без фильтра
+            gift_sent BOOLEAN,
+            status TEXT NOT NULL DEFAULT 'pending', -- pending, running, done, cancelled
+            last_user_id INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            created_by INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            updated_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_broadcast_status ON broadcast_jobs (status)',
+    ]),
+    (4, 'daily stats', [
+        # Дневные итоги (день в UTC, как CURRENT_TIMESTAMP); обновляются вместе с исходными таблицами
+        '''
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            day TEXT PRIMARY KEY, -- YYYY-MM-DD
+            new_users INTEGER NOT NULL DEFAULT 0,
+            approvals INTEGER NOT NULL DEFAULT 0,
+            gifts_sent INTEGER NOT NULL DEFAULT 0,
+            gift_stars_spent INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+        ''',
+        # Заполнение по уже накопленным данным. users.created_at и processed_at пишутся
+        # локальным временем (datetime.now()) - переводим в UTC модификатором 'utc'
+        '''
+        INSERT INTO daily_stats (day, new_users)
+        SELECT date(created_at, 'utc'), COUNT(*) FROM users WHERE created_at IS NOT NULL
+        GROUP BY date(created_at, 'utc')
+        ''',
+        '''
+        INSERT INTO daily_stats (day, approvals)
+        SELECT date(processed_at, 'utc'), COUNT(*) FROM subscription_requests
+        WHERE status = 'approved' AND processed_at IS NOT NULL
+        GROUP BY date(processed_at, 'utc')
+        ON CONFLICT (day) DO UPDATE SET approvals = excluded.approvals
+        ''',
+        '''
+        INSERT INTO daily_stats (day, gifts_sent, gift_stars_spent)
+        SELECT date(created_at), COUNT(*), SUM(amount) FROM stars_balance
+        WHERE operation_type = 'gift_sent' AND created_at IS NOT NULL
+        GROUP BY date(created_at)
+        ON CONFLICT (day) DO UPDATE SET gifts_sent = excluded.gifts_sent,
+                                        gift_stars_spent = excluded.gift_stars_spent
+        ''',
+    ]),
+    (5, 'gift jobs', [
+        # Очередь выдачи подарков. idempotency_key уникален (один подарок на пользователя),
+        # lease_owner/lease_until - аренда задания воркером; просроченная аренда освобождает задание
+        '''
+        CREATE TABLE IF NOT EXISTS gift_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            idempotency_key TEXT NOT NULL UNIQUE,
+            amount INTEGER NOT NULL,
+            gift_type TEXT NOT NULL DEFAULT 'telegram_gift',
+            status TEXT NOT NULL DEFAULT 'pending', -- pending, running, done, failed
+            attempts INTEGER NOT NULL DEFAULT 0,
+            lease_owner TEXT,
+            lease_until TIMESTAMP,
+            available_at TIMESTAMP NOT NULL,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_gift_jobs_status_available ON gift_jobs (status, available_at)',
+        'CREATE INDEX IF NOT EXISTS idx_gift_jobs_status_lease ON gift_jobs (status, lease_until)',
+    ]),
+    (6, 'ledger checkpoints', [
+        # Итоги отрезков журнала stars_balance [first_id, last_id], перенесенных в архив
+        '''
+        CREATE TABLE IF NOT EXISTS ledger_checkpoints (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            first_id INTEGER NOT NULL,
+            last_id INTEGER NOT NULL,
+            rows INTEGER NOT NULL,
+            balance INTEGER NOT NULL,
+            gifts_sent INTEGER NOT NULL,
+            gift_stars_spent INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    (7, 'user summary', [
+        # Сводка по users (одна строка) для админ панели, обновляется вместе с users
+        '''
+        CREATE TABLE IF NOT EXISTS user_summary (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            total_users INTEGER NOT NULL DEFAULT 0,
+            subscribed_users INTEGER NOT NULL DEFAULT 0,
+            awaiting_gift INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        f'INSERT INTO user_summary (id, total_users, subscribed_users, awaiting_gift) SELECT 1, {USER_SUMS} FROM users',
+    ]),
+]
+
+# Таблицы архивной базы (ATTACH ... AS archive): те же колонки, id сохраняются
+ARCHIVE_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS archive.subscription_requests (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        username TEXT,
+        first_name TEXT,
+        last_name TEXT,
+        status TEXT,
+        created_at TIMESTAMP,
+        processed_at TIMESTAMP,
+        processed_by INTEGER
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS archive.idx_archive_requests_user ON subscription_requests (user_id)',
+    '''
+    CREATE TABLE IF NOT EXISTS archive.stars_balance (
+        id INTEGER PRIMARY KEY,
+        amount INTEGER,
+        operation_type TEXT,
+        description TEXT,
+        user_id INTEGER,
+        gift_type TEXT,
+        created_at TIMESTAMP
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS archive.idx_archive_stars_user ON stars_balance (user_id)',
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# Повторный /start обновляет только имя: is_subscribed, gift_sent и created_at сохраняются
+INSERT_USER_SQL = '''
+    INSERT INTO users (user_id, username, first_name, last_name, created_at)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (user_id) DO UPDATE SET
+        username = excluded.username, first_name = excluded.first_name, last_name = excluded.last_name
+'''
+# Пользователи из JSON-списка id, которых еще нет в users (для подсчета новых в daily_stats)
+COUNT_NEW_USERS_SQL = '''
+    SELECT COUNT(DISTINCT value) FROM json_each(?)
+    WHERE value NOT IN (SELECT user_id FROM users)
+'''
+# Одно задание выдачи подарка на пользователя; пропускается, если подарок уже выдан
+ENQUEUE_GIFT_SQL = '''
+    INSERT OR IGNORE INTO gift_jobs (user_id, idempotency_key, amount, gift_type, available_at)
+    SELECT ?, ?, ?, ?, ?
+    WHERE NOT EXISTS (SELECT 1 FROM users WHERE user_id = ? AND gift_sent)
+'''
+# Ключ идемпотентности подарка: переход строки gift_jobs с этим ключом в done
+# происходит один раз, и только он списывает звезды
+def gift_key(user_id: int) -> str:
+    return f'gift:{user_id}'
+
+INSERT_REQUEST_SQL = '''
+    INSERT INTO subscription_requests (id, user_id, username, first_name, last_name)
+    VALUES (?, ?, ?, ?, ?)
+'''
+
+DEFAULT_PAGE_SIZE = 20
+
+class Page(NamedTuple):
+    """Страница результатов с курсорами для перехода вперед и назад"""
+    items: List[Record]
+    next_cursor: Optional[str]
+    prev_cursor: Optional[str]
+
+def encode_cursor(created_at, row_id: int) -> str:
+    """Курсор позиции (created_at, id) в виде строки для callback_data"""
+    return f"{created_at}|{row_id}"
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    created_at, row_id = cursor.rsplit('|', 1)
+    return created_at, int(row_id)
+
+# Горячие запросы. Методы Database выполняют именно эти строки, а
+# benchmarks/check_query_plans.py проверяет их планы выполнения.
+GET_USER_SQL = f'SELECT {User.columns()} FROM users WHERE user_id = ?'
+PENDING_REQUESTS_SQL = f'''
+    SELECT {SubscriptionRequest.columns()} FROM subscription_requests
+    WHERE status = 'pending'
+    ORDER BY created_at ASC
+'''
+COUNT_PENDING_REQUESTS_SQL = "SELECT COUNT(*) FROM subscription_requests WHERE status = 'pending'"
+GIFTS_SENT_SQL = f'''
+    SELECT {LedgerEntry.columns()} FROM stars_balance
+    WHERE operation_type = 'gift_sent'
+    ORDER BY created_at DESC
+'''
+# Задания с истекшей арендой, исчерпавшие попытки (воркер раз за разом зависал или падал),
+# закрываются как failed. Параметры: finished_at, updated_at, сейчас, max_attempts
+FAIL_EXPIRED_GIFT_JOBS_SQL = '''
+    UPDATE gift_jobs
+    SET status = 'failed', lease_owner = NULL, lease_until = NULL,
+        last_error = 'lease expired', finished_at = ?, updated_at = ?
+    WHERE status = 'running' AND lease_until < ? AND attempts >= ?
+'''
+# Захват заданий выдачи подарков: сначала с истекшей арендой, затем готовые ожидающие
+CLAIM_EXPIRED_GIFT_JOBS_SQL = '''
+    SELECT id FROM gift_jobs WHERE status = 'running' AND lease_until < ?
+    ORDER BY lease_until ASC LIMIT ?
+'''
+CLAIM_PENDING_GIFT_JOBS_SQL = '''
+    SELECT id FROM gift_jobs WHERE status = 'pending' AND available_at <= ?
+    ORDER BY available_at ASC LIMIT ?
+'''
+# Возраст считается часами той же зоны, в которой пишется колонка: created_at -
+# CURRENT_TIMESTAMP (UTC), processed_at - datetime.now() (локальное время).
+# Параметры: смещение ('-N days') для каждой колонки, limit
+ARCHIVABLE_REQUESTS_SQL = '''
+    SELECT id FROM main.subscription_requests
+    WHERE status IN ('approved', 'rejected')
+      AND created_at < datetime('now', ?) AND processed_at < datetime('now', 'localtime', ?)
+    LIMIT ?
+'''
+# Начало журнала звезд по id; created_at - CURRENT_TIMESTAMP (UTC). Параметры: смещение, limit
+LEDGER_HEAD_SQL = '''
+    SELECT id, created_at < datetime('now', ?) FROM main.stars_balance ORDER BY id ASC LIMIT ?
+'''
+
+# Ключи keyset-страниц: (таблица, условие, по убыванию)
+PENDING_REQUESTS_PAGE = ('subscription_requests', "status = 'pending'", False)
+GIFTS_SENT_PAGE = ('stars_balance', "operation_type = 'gift_sent'", True)
+
+def page_sql(record: type, table: str, where: str, descending: bool, with_position: bool) -> str:
+    """Запрос keyset-страницы по (created_at, id); параметры: [created_at, id,] limit"""
+    order = 'DESC' if descending else 'ASC'
+    sql = f'SELECT {record.columns()} FROM {table} WHERE {where}'
+    if with_position:
+        sql += f" AND (created_at, id) {'<' if descending else '>'} (?, ?)"
+    return sql + f' ORDER BY created_at {order}, id {order} LIMIT ?'
+
+def user_ids_page_sql(is_subscribed: bool = False, gift_sent: bool = False) -> str:
+    """Запрос страницы user_id; параметры: after_user_id, [is_subscribed,] [gift_sent,] limit"""
+    conditions = ['user_id > ?']
+    if is_subscribed:
+        conditions.append('is_subscribed = ?')
+    if gift_sent:
+        conditions.append('gift_sent = ?')
+    return f"SELECT user_id FROM users WHERE {' AND '.join(conditions)} ORDER BY user_id ASC LIMIT ?"
+
+# Режимы надежности отложенной записи
+DURABILITY_COMMIT = 'commit'       # вызов ждет коммита своей пачки (групповой коммит)
+DURABILITY_BUFFERED = 'buffered'   # вызов возвращается сразу; при сбое теряется не более одной пачки
+
+class WriteBehindBuffer:
+    """Отложенная запись пользователей и заявок пачками.
+
+    Строки копятся в памяти и записываются одной транзакцией через executemany
+    каждые flush_interval_ms миллисекунд или при накоплении flush_max_rows строк.
+    В режиме DURABILITY_COMMIT вызовы ждут коммита, а пачкой становится все, что
+    накопилось за время предыдущего коммита, поэтому пачки возникают только при
+    вызовах из нескольких потоков (AsyncDatabase для этого выполняет add_user и
+    add_subscription_request в отдельном пуле потоков).
+    Если пачка не записалась, строки пишутся по одной: ошибка одной строки не
+    теряет остальные. flush() держит _flush_lock от обмена списков до коммита,
+    поэтому после возврата записаны все строки, поставленные до вызова, даже
+    если их пачку в этот момент пишет фоновый поток. Пока строка не
+    закоммичена, она видна через pending_user / is_pending.
+    Идентификаторы заявок выдаются заранее из счетчика в памяти, поэтому
+    add_subscription_request по-прежнему сразу возвращает id. Режим рассчитан на то,
+    что в базу пишет только этот процесс.
+    """
+
+    def __init__(self, db: 'Database', flush_interval_ms: int, flush_max_rows: int, durability: str):
+        if durability not in (DURABILITY_COMMIT, DURABILITY_BUFFERED):
+            raise ValueError(f"Unknown durability mode: {durability}")
+        self.db = db
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_max_rows = flush_max_rows
+        self.durability = durability
+        self._cond = threading.Condition()
+        # Строки с ожидающим коммита: (строка, [событие, результат] или None)
+        self._users: List[Tuple[Tuple, Optional[list]]] = []
+        self._requests: List[Tuple[Tuple, Optional[list]]] = []
+        self._waiting = 0
+        # Незакоммиченные строки (в буфере или в пишущейся пачке): user_id -> строка, id заявок
+        self._pending_users: Dict[int, Tuple] = {}
+        self._pending_requests: set = set()
+        self._flush_lock = threading.Lock()
+        # Счетчик id заявок; своя блокировка, чтобы не брать db._lock под _cond
+        self._id_lock = threading.Lock()
+        self._next_request_id: Optional[int] = None
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='db-write-behind', daemon=True)
+        self._thread.start()
+
+    def __len__(self) -> int:
+        return len(self._users) + len(self._requests)
+
+    def _reserve_request_id(self) -> int:
+        with self._id_lock:
+            if self._next_request_id is None:
+                with self.db._transaction() as cursor:
+                    cursor.execute('''
+                        SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'subscription_requests'), 0),
+                                   COALESCE((SELECT MAX(id) FROM subscription_requests), 0))
+                    ''')
+                    self._next_request_id = cursor.fetchone()[0] + 1
+            request_id = self._next_request_id
+            self._next_request_id += 1
+            return request_id
+
+    def _enqueue(self, rows: List[Tuple[Tuple, Optional[list]]], row: Tuple) -> bool:
+        waiter = None
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("Write-behind buffer is stopped")
+            if self.durability == DURABILITY_COMMIT:
+                waiter = [threading.Event(), False]
+                self._waiting += 1
+            rows.append((row, waiter))
+            if rows is self._users:
+                self._pending_users[row[0]] = row
+            else:
+                self._pending_requests.add(row[0])
+            if waiter is not None or len(self) >= self.flush_max_rows:
+                self._cond.notify()
+        if waiter is None:
+            return True
+        waiter[0].wait()
+        return waiter[1]
+
+    def add_user(self, row: Tuple) -> bool:
+        return self._enqueue(self._users, row)
+
+    def pending_user(self, user_id: int) -> Optional[Tuple]:
+        """Последняя незакоммиченная строка пользователя или None"""
+        with self._cond:
+            return self._pending_users.get(user_id)
+
+    def is_pending(self, user_id: Optional[int] = None, request_id: Optional[int] = None) -> bool:
+        """Есть ли незакоммиченная строка пользователя или заявки"""
+        with self._cond:
+            return user_id in self._pending_users or request_id in self._pending_requests
+
+    def add_subscription_request(self, user_id: int, username: Optional[str],
+                                 first_name: Optional[str], last_name: Optional[str]) -> int:
+        # id выдается вне _cond: порядок блокировок всегда _id_lock -> db._lock
+        request_id = self._reserve_request_id()
+        return request_id if self._enqueue(
+            self._requests, (request_id, user_id, username, first_name, last_name)) else 0
+
+    def _write(self, users: List[Tuple], requests: List[Tuple]):
+        with self.db._transaction() as cursor:
+            if users:
+                self.db._record_new_users(cursor, [row[0] for row in users])
+                cursor.executemany(INSERT_USER_SQL, users)
+            if requests:
+                cursor.executemany(INSERT_REQUEST_SQL, requests)
+
+    def flush(self) -> int:
+        """Запись накопленных строк одной транзакцией; возвращает число записанных строк"""
+        with self._flush_lock:
+            with self._cond:
+                users, self._users = self._users, []
+                requests, self._requests = self._requests, []
+                self._waiting = 0
+            if not users and not requests:
+                return 0
+            results = self._write_batch(users, requests)
+            with self._cond:
+                for row, _ in users:
+                    if self._pending_users.get(row[0]) is row:
+                        del self._pending_users[row[0]]
+                self._pending_requests.difference_update(row[0] for row, _ in requests)
+        for waiter, ok in results:
+            if waiter is not None:
+                waiter[1] = ok
+                waiter[0].set()
+        return sum(ok for _, ok in results)
+
+    def _write_batch(self, users: List[Tuple[Tuple, Optional[list]]],
+                     requests: List[Tuple[Tuple, Optional[list]]]) -> List[Tuple[Optional[list], bool]]:
+        """Запись пачки; при ошибке - по одной строке. Возвращает (ожидающий, записана ли строка)"""
+        results: List[Tuple[Optional[list], bool]] = []
+        try:
+            self._write([row for row, _ in users], [row for row, _ in requests])
+            results = [(waiter, True) for _, waiter in users + requests]
+        except Exception as e:
+            logger.error(f"Error flushing write-behind buffer ({len(users)} users, {len(requests)} requests), "
+                         f"retrying row by row: {e}")
+            for kind, rows in (('user', users), ('request', requests)):
+                for row, waiter in rows:
+                    try:
+                        self._write([row] if kind == 'user' else [], [row] if kind == 'request' else [])
+                        results.append((waiter, True))
+                    except Exception as row_error:
+                        logger.error(f"Error writing buffered {kind} {row}: {row_error}")
+                        results.append((waiter, False))
+        return results
+
+    def _ready(self) -> bool:
+        # В режиме commit пачка копится, пока идет предыдущий коммит, и пишется сразу
+        if self.durability == DURABILITY_COMMIT and self._waiting:
+            return True
+        return self._stopped or len(self) >= self.flush_max_rows
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._ready():
+                    self._cond.wait(self.flush_interval)
+                stopped = self._stopped
+            self.flush()
+            if stopped:
+                return
+
+    def stop(self):
+        """Остановка фонового потока с записью оставшихся строк"""
+        with self._cond:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join()
+        self.flush()
+
+def probe_connection(conn) -> Dict:
+    """Время чтения и PRAGMA quick_check через соединение или курсор SQLite.
+    
+    Общая проверка для Database.probe() и health_check.py (который открывает
+    базу только на чтение, не создавая ее и не применяя миграции).
+    """
+    started = time.perf_counter()
+    conn.execute('SELECT value FROM settings LIMIT 1').fetchall()
+    read_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    check = conn.execute('PRAGMA quick_check').fetchone()[0]
+    check_ms = (time.perf_counter() - started) * 1000
+    return {'db_ok': check == 'ok', 'db_read_ms': read_ms,
+            'db_quick_check_ms': check_ms, 'db_quick_check': check}
+
 class Database:
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, cache_size_kb: int = DEFAULT_CACHE_SIZE_KB,
+                 mmap_size: int = DEFAULT_MMAP_SIZE, settings_ttl: Optional[float] = None,
+                 write_behind: bool = False, flush_interval_ms: int = 50,
+                 flush_max_rows: int = 500, durability: str = DURABILITY_COMMIT,
+                 dashboard_ttl: float = DEFAULT_DASHBOARD_TTL):
         self.db_path = db_path
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        # Время жизни кэша настроек в секундах; None - кэш обновляется только через set_setting
+        # (достаточно, если базу использует один процесс)
+        self.settings_ttl = settings_ttl
+        self._settings: Optional[Dict[str, str]] = None
+        self._settings_loaded_at = 0.0
+        # Кэш get_dashboard_snapshot: (время построения, число дней, сводка)
+        self.dashboard_ttl = dashboard_ttl
+        self._dashboard: Optional[Tuple[float, int, Dict]] = None
+        # Базы без incremental auto-vacuum, о которых уже предупредили
+        self._vacuum_skipped: set = set()
+        # Одно долгоживущее соединение на экземпляр, доступ сериализуется блокировкой
+        self._lock = threading.RLock()
+        self._conn = self._connect()
         self.init_database()
+        # Отложенная пакетная запись add_user / add_subscription_request (по желанию)
+        self._write_buffer: Optional[WriteBehindBuffer] = None
+        if write_behind:
+            self._write_buffer = WriteBehindBuffer(self, flush_interval_ms, flush_max_rows, durability)
+            atexit.register(self._write_buffer.stop)
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Открытие соединения и настройка PRAGMA"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=DEFAULT_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            cached_statements=DEFAULT_CACHED_STATEMENTS,
+        )
+        # Действует только для новой базы; существующую переводит enable_incremental_vacuum
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('PRAGMA journal_mode = WAL')
+        # В режиме WAL NORMAL безопасен для целостности и не делает fsync на каждый коммит
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute(f'PRAGMA cache_size = {-int(self.cache_size_kb)}')
+        conn.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        return conn
+    
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Cursor]:
+        """Курсор общего соединения внутри транзакции (commit/rollback автоматически)"""
+        with self._lock:
+            cursor = self._conn.cursor()
+            try:
+                yield cursor
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+            finally:
+                cursor.close()
+    
+    def flush(self) -> int:
+        """Немедленная запись отложенных строк (если включена отложенная запись)"""
+        return self._write_buffer.flush() if self._write_buffer is not None else 0
+    
+    def _sync_write_buffer(self, user_id: Optional[int] = None, request_id: Optional[int] = None):
+        """Запись отложенных строк, от которых зависит следующий запрос.
+        
+        Без аргументов буфер записывается целиком (списки, счетчики, массовые
+        операции). С user_id / request_id - только если эта строка еще не
+        закоммичена, поэтому точечные запросы горячего пути не дробят пачки.
+        Вызывается до _transaction: фоновая запись берет то же соединение.
+        """
+        buffer = self._write_buffer
+        if buffer is None:
+            return
+        if (user_id is None and request_id is None) or buffer.is_pending(user_id, request_id):
+            buffer.flush()
+    
+    @property
+    def write_behind(self) -> bool:
+        """Включена ли отложенная запись add_user / add_subscription_request"""
+        return self._write_buffer is not None
+    
+    def close(self):
+        """Закрытие соединения с базой данных"""
+        if self._write_buffer is not None:
+            self._write_buffer.stop()
+            atexit.unregister(self._write_buffer.stop)
+            self._write_buffer = None
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
     
     def init_database(self):
         """Инициализация базы данных и создание таблиц"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # Таблица пользователей
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS users (
-                        user_id INTEGER PRIMARY KEY,
-                        username TEXT,
-                        first_name TEXT,
-                        last_name TEXT,
-                        subscribed_at TIMESTAMP,
-                        is_subscribed BOOLEAN DEFAULT FALSE,
-                        gift_sent BOOLEAN DEFAULT FALSE,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
+            with self._transaction() as cursor:
+                self._migrate(cursor)
                 
-                # Таблица заявок на подписку
+                # Инициализация баланса звезд (журнал может быть пуст после сжатия)
                 cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS subscription_requests (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER,
-                        username TEXT,
-                        first_name TEXT,
-                        last_name TEXT,
-                        status TEXT DEFAULT 'pending', -- pending, approved, rejected
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        processed_at TIMESTAMP,
-                        processed_by INTEGER,
-                        FOREIGN KEY (user_id) REFERENCES users (user_id)
-                    )
+                    SELECT EXISTS (SELECT 1 FROM stars_balance) OR EXISTS (SELECT 1 FROM ledger_checkpoints)
                 ''')
-                
-                # Таблица звезд (баланс бота) - реальные Telegram Stars
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS stars_balance (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        amount INTEGER,
-                        operation_type TEXT, -- add, subtract, gift_sent
-                        description TEXT,
-                        user_id INTEGER, -- ID пользователя для подарков
-                        gift_type TEXT, -- тип подарка
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-                
-                # Таблица настроек
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS settings (
-                        key TEXT PRIMARY KEY,
-                        value TEXT,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-                
-                # Инициализация баланса звезд
-                cursor.execute('SELECT COUNT(*) FROM stars_balance')
-                if cursor.fetchone()[0] == 0:
+                if not cursor.fetchone()[0]:
                     cursor.execute('''
                         INSERT INTO stars_balance (amount, operation_type, description)
                         VALUES (0, 'init', 'Initial balance')
                     ''')
                 
+                # Заполнение сводки по уже существующему журналу
+                cursor.execute('SELECT COUNT(*) FROM stars_summary')
+                if cursor.fetchone()[0] == 0:
+                    cursor.execute(LEDGER_TOTALS_SQL)
+                    balance, gifts_sent, gift_stars_spent = cursor.fetchone()
+                    cursor.execute('''
+                        INSERT INTO stars_summary (id, balance, gifts_sent, gift_stars_spent)
+                        VALUES (1, ?, ?, ?)
+                    ''', (balance, gifts_sent, gift_stars_spent))
+                
                 # Инициализация настроек
                 cursor.execute('SELECT COUNT(*) FROM settings')
                 if cursor.fetchone()[0] == 0:
@@ -85,55 +696,120 @@ class Database:
                         ('gift_sticker_id', ''),
                         ('gift_message', '🎉 Поздравляем! Вы получили подарок - мишку! 🐻')
                     ''')
-                
-                conn.commit()
                 logger.info("Database initialized successfully")
                 
         except Exception as e:
             logger.error(f"Error initializing database: {e}")
             raise
     
+    def _migrate(self, cursor: sqlite3.Cursor):
+        """Применение недостающих миграций схемы"""
+        cursor.execute('PRAGMA user_version')
+        current = cursor.fetchone()[0]
+        if current > SCHEMA_VERSION:
+            raise RuntimeError(f"Database schema version {current} is newer than supported {SCHEMA_VERSION}")
+        for version, description, statements in MIGRATIONS:
+            if version <= current:
+                continue
+            # DDL не открывает транзакцию неявно - открываем явно, чтобы миграция была атомарной
+            if not cursor.connection.in_transaction:
+                cursor.execute('BEGIN')
+            for statement in statements:
+                cursor.execute(statement)
+            cursor.execute(f'PRAGMA user_version = {version}')
+            logger.info(f"Applied migration {version}: {description}")
+    
+    def probe(self) -> Dict:
+        """Быстрая проверка базы: время чтения и PRAGMA quick_check"""
+        with self._transaction() as cursor:
+            return probe_connection(cursor)
+    
+    def get_schema_version(self) -> int:
+        """Текущая версия схемы базы данных"""
+        with self._transaction() as cursor:
+            cursor.execute('PRAGMA user_version')
+            return cursor.fetchone()[0]
+    
+    def explain_query_plan(self, sql: str, params: Tuple = ()) -> List[str]:
+        """План выполнения запроса (EXPLAIN QUERY PLAN) в виде списка строк"""
+        with self._transaction() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[3] for row in cursor.fetchall()]
+    
     def add_user(self, user_id: int, username: str = None, first_name: str = None, last_name: str = None) -> bool:
         """Добавление нового пользователя"""
+        row = (user_id, username, first_name, last_name, datetime.now())
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT OR REPLACE INTO users (user_id, username, first_name, last_name, created_at)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (user_id, username, first_name, last_name, datetime.now()))
-                conn.commit()
+            if self._write_buffer is not None:
+                return self._write_buffer.add_user(row)
+            with self._transaction() as cursor:
+                self._record_new_users(cursor, [user_id])
+                cursor.execute(INSERT_USER_SQL, row)
                 return True
         except Exception as e:
             logger.error(f"Error adding user: {e}")
             return False
     
-    def get_user(self, user_id: int) -> Optional[Dict]:
+    def get_user(self, user_id: int) -> Optional[User]:
         """Получение информации о пользователе"""
+        # Буфер смотрим до чтения: строка уходит из него только после коммита
+        pending = self._write_buffer.pending_user(user_id) if self._write_buffer is not None else None
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-                row = cursor.fetchone()
-                if row:
-                    columns = [description[0] for description in cursor.description]
-                    return dict(zip(columns, row))
-                return None
+            with self._transaction() as cursor:
+                cursor.row_factory = User.row_factory
+                cursor.execute(GET_USER_SQL, (user_id,))
+                user = cursor.fetchone()
         except Exception as e:
             logger.error(f"Error getting user: {e}")
             return None
+        if pending is None:
+            return user
+        # Незакоммиченный add_user: как INSERT_USER_SQL - новая строка или новое имя
+        _, username, first_name, last_name, created_at = pending
+        if user is None:
+            return User(user_id, username, first_name, last_name, None, False, False, str(created_at))
+        user.username, user.first_name, user.last_name = username, first_name, last_name
+        return user
+    
+    def get_user_ids_page(self, after_user_id: int = 0, limit: int = 500,
+                          is_subscribed: Optional[bool] = None,
+                          gift_sent: Optional[bool] = None) -> List[int]:
+        """Keyset-страница user_id (по возрастанию) с необязательными фильтрами"""
+        self._sync_write_buffer()
+        params: List = [after_user_id]
+        if is_subscribed is not None:
+            params.append(is_subscribed)
+        if gift_sent is not None:
+            params.append(gift_sent)
+        params.append(limit)
+        try:
+            with self._transaction() as cursor:
+                cursor.execute(user_ids_page_sql(is_subscribed is not None, gift_sent is not None), params)
+                return [row[0] for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Error getting user ids page: {e}")
+            return []
+    
+    def iter_user_ids(self, is_subscribed: Optional[bool] = None, gift_sent: Optional[bool] = None,
+                      batch_size: int = 500, after_user_id: int = 0) -> Iterator[int]:
+        """Потоковый обход user_id пачками"""
+        while True:
+            user_ids = self.get_user_ids_page(after_user_id, batch_size, is_subscribed, gift_sent)
+            yield from user_ids
+            if len(user_ids) < batch_size:
+                return
+            after_user_id = user_ids[-1]
     
     def update_user_subscription(self, user_id: int, is_subscribed: bool) -> bool:
         """Обновление статуса подписки пользователя"""
+        self._sync_write_buffer(user_id=user_id)
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
+            with self._transaction() as cursor, self._user_summary_change(cursor, 'user_id = ?', (user_id,)):
                 cursor.execute('''
                     UPDATE users 
                     SET is_subscribed = ?, subscribed_at = ?
                     WHERE user_id = ?
                 ''', (is_subscribed, datetime.now() if is_subscribed else None, user_id))
-                conn.commit()
                 return True
         except Exception as e:
             logger.error(f"Error updating user subscription: {e}")
@@ -141,15 +817,14 @@ class Database:
     
     def mark_gift_sent(self, user_id: int) -> bool:
         """Отметка о том, что подарок отправлен"""
+        self._sync_write_buffer(user_id=user_id)
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
+            with self._transaction() as cursor, self._user_summary_change(cursor, 'user_id = ?', (user_id,)):
                 cursor.execute('''
                     UPDATE users 
                     SET gift_sent = TRUE
                     WHERE user_id = ?
                 ''', (user_id,))
-                conn.commit()
                 return True
         except Exception as e:
             logger.error(f"Error marking gift sent: {e}")
@@ -159,40 +834,94 @@ class Database:
                                first_name: str = None, last_name: str = None) -> int:
         """Добавление заявки на подписку"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT INTO subscription_requests (user_id, username, first_name, last_name)
-                    VALUES (?, ?, ?, ?)
-                ''', (user_id, username, first_name, last_name))
-                conn.commit()
+            if self._write_buffer is not None:
+                return self._write_buffer.add_subscription_request(user_id, username, first_name, last_name)
+            with self._transaction() as cursor:
+                cursor.execute(INSERT_REQUEST_SQL, (None, user_id, username, first_name, last_name))
                 return cursor.lastrowid
         except Exception as e:
             logger.error(f"Error adding subscription request: {e}")
             return 0
     
-    def get_pending_requests(self) -> List[Dict]:
+    def get_pending_requests(self) -> List[SubscriptionRequest]:
         """Получение всех ожидающих заявок"""
+        self._sync_write_buffer()
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT * FROM subscription_requests 
-                    WHERE status = 'pending' 
-                    ORDER BY created_at ASC
-                ''')
-                rows = cursor.fetchall()
-                columns = [description[0] for description in cursor.description]
-                return [dict(zip(columns, row)) for row in rows]
+            with self._transaction() as cursor:
+                cursor.row_factory = SubscriptionRequest.row_factory
+                cursor.execute(PENDING_REQUESTS_SQL)
+                return cursor.fetchall()
         except Exception as e:
             logger.error(f"Error getting pending requests: {e}")
             return []
     
+    def _fetch_page(self, record: type, source: Tuple[str, str, bool],
+                    after: Optional[str], before: Optional[str], limit: int) -> Page:
+        """Keyset-пагинация по (created_at, id): after - следующая страница, before - предыдущая"""
+        table, where, descending = source
+        forward = before is None
+        position = after if forward else before
+        # Для предыдущей страницы читаем в обратном порядке и переворачиваем результат
+        scan_descending = descending if forward else not descending
+        args: List = list(decode_cursor(position)) if position else []
+        args.append(limit + 1)
+        with self._transaction() as cursor:
+            cursor.row_factory = record.row_factory
+            cursor.execute(page_sql(record, table, where, scan_descending, bool(position)), args)
+            items = cursor.fetchall()
+        has_more = len(items) > limit
+        del items[limit:]
+        if not forward:
+            items.reverse()
+        if not items:
+            return Page(items, None, None)
+        first = encode_cursor(items[0].created_at, items[0].id)
+        last = encode_cursor(items[-1].created_at, items[-1].id)
+        if forward:
+            return Page(items, last if has_more else None, first if position else None)
+        return Page(items, last, first if has_more else None)
+    
+    def count_pending_requests(self) -> int:
+        """Количество ожидающих заявок (по индексу status, created_at)"""
+        self._sync_write_buffer()
+        try:
+            with self._transaction() as cursor:
+                cursor.execute(COUNT_PENDING_REQUESTS_SQL)
+                return cursor.fetchone()[0]
+        except Exception as e:
+            logger.error(f"Error counting pending requests: {e}")
+            return 0
+    
+    def get_pending_requests_page(self, after: Optional[str] = None, before: Optional[str] = None,
+                                  limit: int = DEFAULT_PAGE_SIZE) -> Page:
+        """Страница ожидающих заявок (от старых к новым)"""
+        self._sync_write_buffer()
+        try:
+            return self._fetch_page(SubscriptionRequest, PENDING_REQUESTS_PAGE, after, before, limit)
+        except Exception as e:
+            logger.error(f"Error getting pending requests page: {e}")
+            return Page([], None, None)
+    
+    def iter_pending_requests(self, batch_size: int = 500) -> Iterator[SubscriptionRequest]:
+        """Потоковый обход ожидающих заявок пачками (для выгрузок)"""
+        self._sync_write_buffer()
+        cursor = None
+        while True:
+            page = self._fetch_page(SubscriptionRequest, PENDING_REQUESTS_PAGE, cursor, None, batch_size)
+            yield from page.items
+            if page.next_cursor is None:
+                return
+            cursor = page.next_cursor
+    
     def process_subscription_request(self, request_id: int, status: str, processed_by: int) -> bool:
         """Обработка заявки на подписку"""
+        # Строка пользователя ставится в буфер раньше заявки и пишется не позже нее
+        self._sync_write_buffer(request_id=request_id)
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
+            with self._transaction() as cursor:
+                # Получаем user_id и прежний статус заявки
+                cursor.execute('SELECT user_id, status FROM subscription_requests WHERE id = ?', (request_id,))
+                result = cursor.fetchone()
                 cursor.execute('''
                     UPDATE subscription_requests 
                     SET status = ?, processed_at = ?, processed_by = ?
@@ -200,37 +929,91 @@ class Database:
                 ''', (status, datetime.now(), processed_by, request_id))
                 
                 if status == 'approved':
-                    # Получаем user_id из заявки
-                    cursor.execute('SELECT user_id FROM subscription_requests WHERE id = ?', (request_id,))
-                    result = cursor.fetchone()
                     if result:
                         user_id = result[0]
+                        if result[1] != 'approved':
+                            self._update_daily_stats(cursor, approvals=1)
                         # Обновляем статус подписки пользователя
+                        with self._user_summary_change(cursor, 'user_id = ?', (user_id,)):
+                            cursor.execute('''
+                                UPDATE users 
+                                SET is_subscribed = TRUE, subscribed_at = ?
+                                WHERE user_id = ?
+                            ''', (datetime.now(), user_id))
+                return True
+        except Exception as e:
+            logger.error(f"Error processing subscription request: {e}")
+            return False
+    
+    def process_subscription_requests(self, status: str, processed_by: int,
+                                      request_ids: Optional[List[int]] = None,
+                                      created_from: Optional[datetime] = None,
+                                      created_to: Optional[datetime] = None) -> List[int]:
+        """Массовая обработка ожидающих заявок одной транзакцией.
+        
+        Обрабатываются все ожидающие заявки, либо только из request_ids и/или
+        созданные в интервале [created_from, created_to). Границы - местное
+        время, как datetime.now(); created_at пишется в UTC, поэтому границы
+        переводятся модификатором 'utc'. Возвращает user_id пользователей из
+        обработанных заявок (для пакетной выдачи подарков).
+        """
+        self._sync_write_buffer()
+        conditions = ["status = 'pending'"]
+        params: List = []
+        if created_from is not None:
+            conditions.append("created_at >= datetime(?, 'utc')")
+            params.append(created_from)
+        if created_to is not None:
+            conditions.append("created_at < datetime(?, 'utc')")
+            params.append(created_to)
+        try:
+            with self._transaction() as cursor:
+                if request_ids is not None:
+                    cursor.execute('CREATE TEMP TABLE IF NOT EXISTS bulk_request_ids (id INTEGER PRIMARY KEY)')
+                    cursor.execute('DELETE FROM bulk_request_ids')
+                    cursor.executemany('INSERT OR IGNORE INTO bulk_request_ids (id) VALUES (?)',
+                                       ((request_id,) for request_id in request_ids))
+                    conditions.append('id IN (SELECT id FROM bulk_request_ids)')
+                where = ' AND '.join(conditions)
+                
+                cursor.execute('CREATE TEMP TABLE IF NOT EXISTS bulk_user_ids (user_id INTEGER PRIMARY KEY)')
+                cursor.execute('DELETE FROM bulk_user_ids')
+                cursor.execute(f'''
+                    INSERT OR IGNORE INTO bulk_user_ids (user_id)
+                    SELECT user_id FROM subscription_requests WHERE {where}
+                ''', params)
+                
+                now = datetime.now()
+                cursor.execute(f'''
+                    UPDATE subscription_requests 
+                    SET status = ?, processed_at = ?, processed_by = ?
+                    WHERE {where}
+                ''', [status, now, processed_by] + params)
+                processed = cursor.rowcount
+                logger.info(f"Bulk-processed {processed} subscription requests as {status}")
+                
+                if status == 'approved':
+                    self._update_daily_stats(cursor, approvals=processed)
+                    with self._user_summary_change(cursor, 'user_id IN (SELECT user_id FROM bulk_user_ids)'):
                         cursor.execute('''
                             UPDATE users 
                             SET is_subscribed = TRUE, subscribed_at = ?
-                            WHERE user_id = ?
-                        ''', (datetime.now(), user_id))
+                            WHERE user_id IN (SELECT user_id FROM bulk_user_ids)
+                        ''', (now,))
                 
-                conn.commit()
-                return True
+                cursor.execute('SELECT user_id FROM bulk_user_ids')
+                return [row[0] for row in cursor.fetchall()]
         except Exception as e:
-            logger.error(f"Error processing subscription request: {e}")
-            return False
+            logger.error(f"Error bulk processing subscription requests: {e}")
+            return []
     
     def get_stars_balance(self) -> int:
         """Получение текущего баланса звезд"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT SUM(CASE WHEN operation_type = 'add' THEN amount 
-                                   WHEN operation_type = 'subtract' THEN -amount 
-                                   ELSE 0 END) as balance
-                    FROM stars_balance
-                ''')
+            with self._transaction() as cursor:
+                cursor.execute('SELECT balance FROM stars_summary WHERE id = 1')
                 result = cursor.fetchone()
-                return result[0] if result[0] is not None else 0
+                return result[0] if result else 0
         except Exception as e:
             logger.error(f"Error getting stars balance: {e}")
             return 0
@@ -238,13 +1021,12 @@ class Database:
     def add_stars(self, amount: int, description: str = "Manual addition") -> bool:
         """Пополнение баланса звезд"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
+            with self._transaction() as cursor:
                 cursor.execute('''
                     INSERT INTO stars_balance (amount, operation_type, description)
                     VALUES (?, 'add', ?)
                 ''', (amount, description))
-                conn.commit()
+                self._update_stars_summary(cursor, balance=amount)
                 return True
         except Exception as e:
             logger.error(f"Error adding stars: {e}")
@@ -253,49 +1035,157 @@ class Database:
     def subtract_stars(self, amount: int, description: str = "Manual subtraction") -> bool:
         """Списание звезд"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
+            with self._transaction() as cursor:
                 cursor.execute('''
                     INSERT INTO stars_balance (amount, operation_type, description)
                     VALUES (?, 'subtract', ?)
                 ''', (amount, description))
-                conn.commit()
+                self._update_stars_summary(cursor, balance=-amount)
                 return True
         except Exception as e:
             logger.error(f"Error subtracting stars: {e}")
             return False
     
+    def _update_stars_summary(self, cursor: sqlite3.Cursor, balance: int = 0,
+                              gifts_sent: int = 0, gift_stars_spent: int = 0):
+        """Изменение сводки звезд в текущей транзакции"""
+        cursor.execute('''
+            UPDATE stars_summary
+            SET balance = balance + ?, gifts_sent = gifts_sent + ?,
+                gift_stars_spent = gift_stars_spent + ?, updated_at = ?
+            WHERE id = 1
+        ''', (balance, gifts_sent, gift_stars_spent, datetime.now()))
+    
+    def _update_daily_stats(self, cursor: sqlite3.Cursor, new_users: int = 0, approvals: int = 0,
+                            gifts_sent: int = 0, gift_stars_spent: int = 0):
+        """Прибавление к итогам текущего дня (UTC, как в миграции 4) в текущей транзакции"""
+        if not (new_users or approvals or gifts_sent or gift_stars_spent):
+            return
+        cursor.execute('''
+            INSERT INTO daily_stats (day, new_users, approvals, gifts_sent, gift_stars_spent)
+            VALUES (date('now'), ?, ?, ?, ?)
+            ON CONFLICT (day) DO UPDATE SET
+                new_users = new_users + excluded.new_users,
+                approvals = approvals + excluded.approvals,
+                gifts_sent = gifts_sent + excluded.gifts_sent,
+                gift_stars_spent = gift_stars_spent + excluded.gift_stars_spent
+        ''', (new_users, approvals, gifts_sent, gift_stars_spent))
+    
+    def _record_new_users(self, cursor: sqlite3.Cursor, user_ids: List[int]):
+        """Учет в daily_stats и user_summary пользователей, которых еще нет в users (до их вставки)"""
+        cursor.execute(COUNT_NEW_USERS_SQL, (json.dumps(user_ids),))
+        new_users = cursor.fetchone()[0]
+        self._update_daily_stats(cursor, new_users=new_users)
+        self._update_user_summary(cursor, total_users=new_users)
+    
+    def _update_user_summary(self, cursor: sqlite3.Cursor, total_users: int = 0,
+                             subscribed_users: int = 0, awaiting_gift: int = 0):
+        """Изменение сводки пользователей в текущей транзакции"""
+        if not (total_users or subscribed_users or awaiting_gift):
+            return
+        cursor.execute('''
+            UPDATE user_summary
+            SET total_users = total_users + ?, subscribed_users = subscribed_users + ?,
+                awaiting_gift = awaiting_gift + ?, updated_at = ?
+            WHERE id = 1
+        ''', (total_users, subscribed_users, awaiting_gift, datetime.now()))
+    
+    @contextmanager
+    def _user_summary_change(self, cursor: sqlite3.Cursor, where: str, params: Tuple = ()) -> Iterator[None]:
+        """Перенос в user_summary изменений строк users (отобранных where) внутри блока"""
+        cursor.execute(f'SELECT {USER_SUMS} FROM users WHERE {where}', params)
+        before = cursor.fetchone()
+        yield
+        cursor.execute(f'SELECT {USER_SUMS} FROM users WHERE {where}', params)
+        self._update_user_summary(cursor, *(after - old for after, old in zip(cursor.fetchone(), before)))
+    
+    def reconcile(self) -> Dict[str, int]:
+        """Пересчет сводок звезд и пользователей по исходным таблицам; возвращает расхождения (таблицы - сводка)"""
+        try:
+            with self._transaction() as cursor:
+                cursor.execute(LEDGER_TOTALS_SQL)
+                actual = dict(zip(('balance', 'gifts_sent', 'gift_stars_spent'), cursor.fetchone()))
+                cursor.execute('SELECT balance, gifts_sent, gift_stars_spent FROM stars_summary WHERE id = 1')
+                stored = cursor.fetchone() or (0, 0, 0)
+                drift = {key: actual[key] - value for key, value in zip(actual, stored)}
+                cursor.execute('''
+                    INSERT OR REPLACE INTO stars_summary (id, balance, gifts_sent, gift_stars_spent, updated_at)
+                    VALUES (1, ?, ?, ?, ?)
+                ''', (actual['balance'], actual['gifts_sent'], actual['gift_stars_spent'], datetime.now()))
+                
+                cursor.execute(f'SELECT {USER_SUMS} FROM users')
+                users = dict(zip(('total_users', 'subscribed_users', 'awaiting_gift'), cursor.fetchone()))
+                cursor.execute('SELECT total_users, subscribed_users, awaiting_gift FROM user_summary WHERE id = 1')
+                stored = cursor.fetchone() or (0, 0, 0)
+                drift.update((key, users[key] - value) for key, value in zip(users, stored))
+                cursor.execute('''
+                    INSERT OR REPLACE INTO user_summary (id, total_users, subscribed_users, awaiting_gift, updated_at)
+                    VALUES (1, ?, ?, ?, ?)
+                ''', (users['total_users'], users['subscribed_users'], users['awaiting_gift'], datetime.now()))
+            if any(drift.values()):
+                logger.warning(f"Summary drift corrected: {drift}")
+            return drift
+        except Exception as e:
+            logger.error(f"Error reconciling summaries: {e}")
+            raise
+    
+    def _load_settings(self) -> Dict[str, str]:
+        """Загрузка всех настроек в кэш"""
+        with self._transaction() as cursor:
+            cursor.execute('SELECT key, value FROM settings')
+            self._settings = dict(cursor.fetchall())
+            self._settings_loaded_at = time.monotonic()
+            return self._settings
+    
+    def invalidate_settings_cache(self):
+        """Сброс кэша настроек (следующее чтение загрузит их из базы)"""
+        self._settings = None
+    
     def get_setting(self, key: str) -> Optional[str]:
         """Получение настройки"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('SELECT value FROM settings WHERE key = ?', (key,))
-                result = cursor.fetchone()
-                return result[0] if result else None
+            settings = self._settings
+            if settings is None or (self.settings_ttl is not None and
+                                    time.monotonic() - self._settings_loaded_at > self.settings_ttl):
+                settings = self._load_settings()
+            return settings.get(key)
         except Exception as e:
             logger.error(f"Error getting setting: {e}")
             return None
     
+    def get_bool_setting(self, key: str, default: bool = False) -> bool:
+        """Получение логической настройки ('true'/'false')"""
+        value = self.get_setting(key)
+        return value == 'true' if value else default
+    
+    def get_int_setting(self, key: str, default: int = 0) -> int:
+        """Получение целочисленной настройки"""
+        value = self.get_setting(key)
+        try:
+            return int(value) if value else default
+        except ValueError:
+            logger.error(f"Setting {key} is not an integer: {value!r}")
+            return default
+    
     def set_setting(self, key: str, value: str) -> bool:
         """Установка настройки"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
+            with self._transaction() as cursor:
                 cursor.execute('''
                     INSERT OR REPLACE INTO settings (key, value, updated_at)
                     VALUES (?, ?, ?)
                 ''', (key, value, datetime.now()))
-                conn.commit()
-                return True
+            # Кэш обновляется только после успешного коммита
+            if self._settings is not None:
+                self._settings[key] = value
+            return True
         except Exception as e:
             logger.error(f"Error setting setting: {e}")
             return False
     
     def get_auto_approval_status(self) -> bool:
         """Получение статуса автоматического одобрения"""
-        value = self.get_setting('auto_approval')
-        return value == 'true' if value else False
+        return self.get_bool_setting('auto_approval')
     
     def set_auto_approval_status(self, enabled: bool) -> bool:
         """Установка статуса автоматического одобрения"""
@@ -304,44 +1194,315 @@ class Database:
     def send_gift_stars(self, user_id: int, amount: int, gift_type: str = "telegram_gift") -> bool:
         """Списание звезд за отправку подарка"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT INTO stars_balance (amount, operation_type, description, user_id, gift_type)
-                    VALUES (?, 'gift_sent', ?, ?, ?)
-                ''', (amount, f"Gift sent to user {user_id}", user_id, gift_type))
-                conn.commit()
+            with self._transaction() as cursor:
+                self._insert_gift_entry(cursor, user_id, amount, gift_type)
                 return True
         except Exception as e:
             logger.error(f"Error sending gift stars: {e}")
             return False
     
-    def get_gifts_sent(self) -> List[Dict]:
+    def _insert_gift_entry(self, cursor: sqlite3.Cursor, user_id: int, amount: int, gift_type: str):
+        """Запись подарка в журнал звезд, сводку и дневные итоги в текущей транзакции"""
+        cursor.execute('''
+            INSERT INTO stars_balance (amount, operation_type, description, user_id, gift_type)
+            VALUES (?, 'gift_sent', ?, ?, ?)
+        ''', (amount, f"Gift sent to user {user_id}", user_id, gift_type))
+        self._update_stars_summary(cursor, gifts_sent=1, gift_stars_spent=amount)
+        self._update_daily_stats(cursor, gifts_sent=1, gift_stars_spent=amount)
+    
+    def _set_gift_sent_once(self, cursor: sqlite3.Cursor, user_id: int) -> bool:
+        """gift_sent = TRUE в текущей транзакции; False, если подарок уже был выдан"""
+        with self._user_summary_change(cursor, 'user_id = ?', (user_id,)):
+            cursor.execute('UPDATE users SET gift_sent = TRUE WHERE user_id = ? AND NOT gift_sent', (user_id,))
+            if cursor.rowcount:
+                return True
+            cursor.execute('SELECT 1 FROM users WHERE user_id = ?', (user_id,))
+            if cursor.fetchone():
+                return False
+            # Пользователь не писал боту (только заявка в канал) или его add_user еще в буфере
+            # отложенной записи - заводим строку; отложенная вставка потом обновит только имя
+            self._update_daily_stats(cursor, new_users=1)
+            cursor.execute('INSERT INTO users (user_id, gift_sent, created_at) VALUES (?, TRUE, ?)',
+                           (user_id, datetime.now()))
+            return True
+    
+    def record_gift(self, user_id: int, amount: int, gift_type: str = "telegram_gift") -> bool:
+        """Подарок, выданный вручную: списание звезд и отметка gift_sent одной транзакцией.
+        
+        Закрывает задание gift_jobs с ключом пользователя (создает его при
+        необходимости), поэтому повторный вызов или доставка того же подарка
+        воркером ничего не списывают и возвращают False.
+        """
+        now = datetime.now()
+        try:
+            with self._transaction() as cursor:
+                cursor.execute('''
+                    INSERT OR IGNORE INTO gift_jobs (user_id, idempotency_key, amount, gift_type, available_at)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (user_id, gift_key(user_id), amount, gift_type, now))
+                cursor.execute('''
+                    UPDATE gift_jobs
+                    SET status = 'done', amount = ?, gift_type = ?, lease_owner = NULL, lease_until = NULL,
+                        updated_at = ?, finished_at = ?
+                    WHERE idempotency_key = ? AND status != 'done'
+                ''', (amount, gift_type, now, now, gift_key(user_id)))
+                if cursor.rowcount == 0:
+                    return False
+                # Подарки, выданные до очереди, отмечены только в users.gift_sent
+                if not self._set_gift_sent_once(cursor, user_id):
+                    return False
+                self._insert_gift_entry(cursor, user_id, amount, gift_type)
+                return True
+        except Exception as e:
+            logger.error(f"Error recording gift: {e}")
+            return False
+    
+    def get_gifts_sent(self) -> List[LedgerEntry]:
         """Получение списка отправленных подарков"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
+            with self._transaction() as cursor:
+                cursor.row_factory = LedgerEntry.row_factory
+                cursor.execute(GIFTS_SENT_SQL)
+                return cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Error getting gifts sent: {e}")
+            return []
+    
+    def get_gifts_sent_page(self, after: Optional[str] = None, before: Optional[str] = None,
+                            limit: int = DEFAULT_PAGE_SIZE) -> Page:
+        """Страница отправленных подарков (от новых к старым)"""
+        try:
+            return self._fetch_page(LedgerEntry, GIFTS_SENT_PAGE, after, before, limit)
+        except Exception as e:
+            logger.error(f"Error getting gifts sent page: {e}")
+            return Page([], None, None)
+    
+    def iter_gifts_sent(self, batch_size: int = 500) -> Iterator[LedgerEntry]:
+        """Потоковый обход отправленных подарков пачками (для выгрузок)"""
+        cursor = None
+        while True:
+            page = self._fetch_page(LedgerEntry, GIFTS_SENT_PAGE, cursor, None, batch_size)
+            yield from page.items
+            if page.next_cursor is None:
+                return
+            cursor = page.next_cursor
+    
+    def create_broadcast(self, text: str, created_by: int, is_subscribed: Optional[bool] = None,
+                         gift_sent: Optional[bool] = None) -> int:
+        """Создание задания рассылки; возвращает его id"""
+        conditions, params = ['1'], []
+        if is_subscribed is not None:
+            conditions.append('is_subscribed = ?')
+            params.append(is_subscribed)
+        if gift_sent is not None:
+            conditions.append('gift_sent = ?')
+            params.append(gift_sent)
+        try:
+            with self._transaction() as cursor:
+                cursor.execute(f"SELECT COUNT(*) FROM users WHERE {' AND '.join(conditions)}", params)
+                total = cursor.fetchone()[0]
                 cursor.execute('''
-                    SELECT * FROM stars_balance 
-                    WHERE operation_type = 'gift_sent' 
-                    ORDER BY created_at DESC
+                    INSERT INTO broadcast_jobs (text, is_subscribed, gift_sent, total, created_by)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (text, is_subscribed, gift_sent, total, created_by))
+                return cursor.lastrowid
+        except Exception as e:
+            logger.error(f"Error creating broadcast: {e}")
+            return 0
+    
+    def get_broadcast(self, job_id: int) -> Optional[BroadcastJob]:
+        """Получение задания рассылки"""
+        try:
+            with self._transaction() as cursor:
+                cursor.row_factory = BroadcastJob.row_factory
+                cursor.execute(f'SELECT {BroadcastJob.columns()} FROM broadcast_jobs WHERE id = ?', (job_id,))
+                return cursor.fetchone()
+        except Exception as e:
+            logger.error(f"Error getting broadcast: {e}")
+            return None
+    
+    def get_active_broadcasts(self) -> List[BroadcastJob]:
+        """Незавершенные задания рассылки (для продолжения после перезапуска)"""
+        try:
+            with self._transaction() as cursor:
+                cursor.row_factory = BroadcastJob.row_factory
+                cursor.execute(f'''
+                    SELECT {BroadcastJob.columns()} FROM broadcast_jobs
+                    WHERE status IN ('pending', 'running')
+                    ORDER BY id ASC
                 ''')
-                rows = cursor.fetchall()
-                columns = [description[0] for description in cursor.description]
-                return [dict(zip(columns, row)) for row in rows]
+                return cursor.fetchall()
         except Exception as e:
-            logger.error(f"Error getting gifts sent: {e}")
+            logger.error(f"Error getting active broadcasts: {e}")
             return []
     
+    def update_broadcast_progress(self, job_id: int, last_user_id: int, sent: int, failed: int) -> bool:
+        """Сохранение позиции рассылки и прироста счетчиков после пачки"""
+        try:
+            with self._transaction() as cursor:
+                cursor.execute('''
+                    UPDATE broadcast_jobs
+                    SET last_user_id = ?, sent = sent + ?, failed = failed + ?, updated_at = ?
+                    WHERE id = ?
+                ''', (last_user_id, sent, failed, datetime.now(), job_id))
+                return True
+        except Exception as e:
+            logger.error(f"Error updating broadcast progress: {e}")
+            return False
+    
+    def set_broadcast_status(self, job_id: int, status: str) -> bool:
+        """Смена статуса рассылки (running, done, cancelled)"""
+        now = datetime.now()
+        try:
+            with self._transaction() as cursor:
+                cursor.execute('''
+                    UPDATE broadcast_jobs
+                    SET status = ?, updated_at = ?,
+                        started_at = CASE WHEN ? = 'running' THEN COALESCE(started_at, ?) ELSE started_at END,
+                        finished_at = CASE WHEN ? IN ('done', 'cancelled') THEN ? ELSE finished_at END
+                    WHERE id = ?
+                ''', (status, now, status, now, status, now, job_id))
+                return True
+        except Exception as e:
+            logger.error(f"Error setting broadcast status: {e}")
+            return False
+    
+    def enqueue_gifts(self, user_ids: List[int], amount: int, gift_type: str = "telegram_gift") -> int:
+        """Постановка подарков в очередь; возвращает число новых заданий.
+        
+        Ключ идемпотентности - пользователь: повторная постановка и пользователи,
+        уже получившие подарок, пропускаются.
+        """
+        self._sync_write_buffer()
+        now = datetime.now()
+        try:
+            with self._transaction() as cursor:
+                before = cursor.connection.total_changes
+                cursor.executemany(ENQUEUE_GIFT_SQL, (
+                    (user_id, gift_key(user_id), amount, gift_type, now, user_id) for user_id in user_ids))
+                return cursor.connection.total_changes - before
+        except Exception as e:
+            logger.error(f"Error enqueueing gifts: {e}")
+            return 0
+    
+    def claim_gift_jobs(self, worker_id: str, limit: int = 10, lease_seconds: float = 60,
+                        max_attempts: int = 5) -> List[GiftJob]:
+        """Захват готовых заданий воркером с арендой на lease_seconds.
+        
+        Берутся ожидающие задания и задания с истекшей арендой (воркер упал);
+        задания с истекшей арендой после max_attempts попыток закрываются как
+        failed. BEGIN IMMEDIATE сразу берет блокировку записи, поэтому два
+        воркера (в том числе из разных процессов) не захватят одно задание.
+        """
+        now = datetime.now()
+        try:
+            with self._transaction() as cursor:
+                cursor.execute('BEGIN IMMEDIATE')
+                cursor.execute(FAIL_EXPIRED_GIFT_JOBS_SQL, (now, now, now, max_attempts))
+                if cursor.rowcount:
+                    logger.warning(f"{cursor.rowcount} gift jobs failed: lease expired after {max_attempts} attempts")
+                cursor.execute(CLAIM_EXPIRED_GIFT_JOBS_SQL, (now, limit))
+                job_ids = [row[0] for row in cursor.fetchall()]
+                if len(job_ids) < limit:
+                    cursor.execute(CLAIM_PENDING_GIFT_JOBS_SQL, (now, limit - len(job_ids)))
+                    job_ids.extend(row[0] for row in cursor.fetchall())
+                if not job_ids:
+                    return []
+                placeholders = ', '.join('?' * len(job_ids))
+                cursor.execute(f'''
+                    UPDATE gift_jobs
+                    SET status = 'running', lease_owner = ?, lease_until = ?,
+                        attempts = attempts + 1, updated_at = ?
+                    WHERE id IN ({placeholders})
+                ''', [worker_id, now + timedelta(seconds=lease_seconds), now] + job_ids)
+                cursor.row_factory = GiftJob.row_factory
+                cursor.execute(f'''
+                    SELECT {GiftJob.columns()} FROM gift_jobs WHERE id IN ({placeholders}) ORDER BY id ASC
+                ''', job_ids)
+                return cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Error claiming gift jobs: {e}")
+            return []
+    
+    def renew_gift_lease(self, job_id: int, worker_id: str, lease_seconds: float = 60) -> bool:
+        """Продление аренды задания на lease_seconds; False, если аренда уже потеряна"""
+        now = datetime.now()
+        try:
+            with self._transaction() as cursor:
+                cursor.execute('''
+                    UPDATE gift_jobs SET lease_until = ?, updated_at = ?
+                    WHERE id = ? AND status = 'running' AND lease_owner = ?
+                ''', (now + timedelta(seconds=lease_seconds), now, job_id, worker_id))
+                return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"Error renewing gift lease: {e}")
+            return False
+    
+    def complete_gift_job(self, job_id: int, worker_id: str) -> bool:
+        """Завершение задания: запись в журнал звезд, gift_sent и статус done одной транзакцией.
+        
+        Возвращает False, если аренда уже потеряна (задание забрал другой воркер)
+        или подарок этому пользователю уже списан - звезды второй раз не тратятся.
+        """
+        now = datetime.now()
+        try:
+            with self._transaction() as cursor:
+                cursor.execute('''
+                    UPDATE gift_jobs SET status = 'done', lease_until = NULL, updated_at = ?, finished_at = ?
+                    WHERE id = ? AND status = 'running' AND lease_owner = ?
+                ''', (now, now, job_id, worker_id))
+                if cursor.rowcount == 0:
+                    return False
+                cursor.execute('SELECT user_id, amount, gift_type FROM gift_jobs WHERE id = ?', (job_id,))
+                user_id, amount, gift_type = cursor.fetchone()
+                # Переход в done выше - единственное место списания по этому ключу;
+                # gift_sent проверяется для подарков, выданных до очереди
+                if not self._set_gift_sent_once(cursor, user_id):
+                    logger.warning(f"Gift job {job_id}: user {user_id} already has a gift, not charged")
+                    return False
+                self._insert_gift_entry(cursor, user_id, amount, gift_type)
+                return True
+        except Exception as e:
+            logger.error(f"Error completing gift job: {e}")
+            return False
+    
+    def fail_gift_job(self, job_id: int, worker_id: str, error: str,
+                      retry_delay: float = 60, max_attempts: int = 5) -> bool:
+        """Неудачная попытка: повтор через retry_delay секунд или статус failed после max_attempts"""
+        now = datetime.now()
+        try:
+            with self._transaction() as cursor:
+                cursor.execute('''
+                    UPDATE gift_jobs
+                    SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                        finished_at = CASE WHEN attempts >= ? THEN ? ELSE NULL END,
+                        available_at = ?, lease_owner = NULL, lease_until = NULL,
+                        last_error = ?, updated_at = ?
+                    WHERE id = ? AND status = 'running' AND lease_owner = ?
+                ''', (max_attempts, max_attempts, now, now + timedelta(seconds=retry_delay),
+                      error[:500], now, job_id, worker_id))
+                return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"Error failing gift job: {e}")
+            return False
+    
+    def get_gift_queue_stats(self) -> Dict[str, int]:
+        """Количество заданий выдачи подарков по статусам"""
+        try:
+            with self._transaction() as cursor:
+                cursor.execute('SELECT status, COUNT(*) FROM gift_jobs GROUP BY status')
+                stats = {'pending': 0, 'running': 0, 'done': 0, 'failed': 0}
+                stats.update(cursor.fetchall())
+                return stats
+        except Exception as e:
+            logger.error(f"Error getting gift queue stats: {e}")
+            return {}
+    
     def get_total_gifts_sent(self) -> int:
         """Получение общего количества отправленных подарков"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT COUNT(*) FROM stars_balance 
-                    WHERE operation_type = 'gift_sent'
-                ''')
+            with self._transaction() as cursor:
+                cursor.execute('SELECT gifts_sent FROM stars_summary WHERE id = 1')
                 result = cursor.fetchone()
                 return result[0] if result else 0
         except Exception as e:
@@ -351,14 +1512,229 @@ class Database:
     def get_total_stars_spent_on_gifts(self) -> int:
         """Получение общего количества звезд, потраченных на подарки"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT SUM(amount) FROM stars_balance 
-                    WHERE operation_type = 'gift_sent'
-                ''')
+            with self._transaction() as cursor:
+                cursor.execute('SELECT gift_stars_spent FROM stars_summary WHERE id = 1')
                 result = cursor.fetchone()
-                return result[0] if result[0] is not None else 0
+                return result[0] if result else 0
         except Exception as e:
             logger.error(f"Error getting total stars spent on gifts: {e}")
             return 0
+    
+    def get_daily_stats(self, date_from: Optional[str] = None,
+                        date_to: Optional[str] = None) -> List[DailyStats]:
+        """Дневные итоги за интервал [date_from, date_to] (YYYY-MM-DD, по возрастанию дня)"""
+        try:
+            with self._transaction() as cursor:
+                cursor.row_factory = DailyStats.row_factory
+                cursor.execute(f'''
+                    SELECT {DailyStats.columns()} FROM daily_stats
+                    WHERE day >= ? AND day <= ?
+                    ORDER BY day ASC
+                ''', (date_from or '0000-00-00', date_to or '9999-99-99'))
+                return cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Error getting daily stats: {e}")
+            return []
+    
+    def get_dashboard_snapshot(self, days: int = DEFAULT_DASHBOARD_DAYS, force: bool = False) -> Dict:
+        """Все показатели админ панели из одной читающей транзакции.
+        
+        Сводка кэшируется на dashboard_ttl секунд, поэтому частые обновления
+        экрана статистики почти ничего не стоят. days - сколько последних дней
+        из daily_stats вернуть в 'daily' (для графиков).
+        """
+        cached = self._dashboard
+        if (not force and cached is not None and cached[1] == days
+                and time.monotonic() - cached[0] < self.dashboard_ttl):
+            return dict(cached[2])
+        self._sync_write_buffer()
+        try:
+            with self._transaction() as cursor:
+                # Явная транзакция: все запросы видят один и тот же снимок базы
+                cursor.execute('BEGIN')
+                cursor.execute('SELECT total_users, subscribed_users, awaiting_gift FROM user_summary WHERE id = 1')
+                total_users, subscribed_users, awaiting_gift = cursor.fetchone() or (0, 0, 0)
+                cursor.execute("SELECT COUNT(*) FROM subscription_requests WHERE status = 'pending'")
+                pending_requests = cursor.fetchone()[0]
+                cursor.execute('SELECT balance, gifts_sent, gift_stars_spent FROM stars_summary WHERE id = 1')
+                balance, gifts_sent, gift_stars_spent = cursor.fetchone() or (0, 0, 0)
+                cursor.execute("SELECT value FROM settings WHERE key = 'auto_approval'")
+                auto_approval = cursor.fetchone()
+                cursor.execute("SELECT date('now')")
+                today = cursor.fetchone()[0]
+                cursor.row_factory = DailyStats.row_factory
+                cursor.execute(f'''
+                    SELECT {DailyStats.columns()} FROM daily_stats
+                    WHERE day > date('now', ?)
+                    ORDER BY day ASC
+                ''', (f'-{int(days)} days',))
+                daily = cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Error getting dashboard snapshot: {e}")
+            return {}
+        snapshot = {
+            'total_users': total_users,
+            'subscribed_users': subscribed_users,
+            'awaiting_gift': awaiting_gift,
+            'pending_requests': pending_requests,
+            'stars_balance': balance,
+            'gifts_sent': gifts_sent,
+            'gift_stars_spent': gift_stars_spent,
+            'auto_approval': bool(auto_approval) and auto_approval[0] == 'true',
+            'today': next((row.to_dict() for row in daily if row.day == today),
+                          DailyStats(today, 0, 0, 0, 0).to_dict()),
+            'daily': [row.to_dict() for row in daily],
+            'generated_at': datetime.now(),
+        }
+        self._dashboard = (time.monotonic(), days, snapshot)
+        return dict(snapshot)
+    
+    def attach_archive(self, archive_path: Optional[str] = None) -> str:
+        """Подключение архивной базы (ATTACH ... AS archive) и создание ее таблиц.
+        
+        По умолчанию архив лежит рядом с основной базой: bot.db -> bot_archive.db.
+        """
+        archive_path = archive_path or f'{os.path.splitext(self.db_path)[0]}_archive.db'
+        with self._lock:
+            attached = {row[1] for row in self._conn.execute('PRAGMA database_list')}
+            if 'archive' not in attached:
+                self._conn.execute('ATTACH DATABASE ? AS archive', (archive_path,))
+                self._conn.execute('PRAGMA archive.auto_vacuum = INCREMENTAL')
+                self._conn.execute('PRAGMA archive.journal_mode = WAL')
+                self._conn.execute('PRAGMA archive.synchronous = NORMAL')
+            with self._transaction() as cursor:
+                cursor.execute('BEGIN')
+                for statement in ARCHIVE_SCHEMA:
+                    cursor.execute(statement)
+        return archive_path
+    
+    def _require_archive(self, cursor: sqlite3.Cursor):
+        cursor.execute('PRAGMA database_list')
+        if 'archive' not in {row[1] for row in cursor.fetchall()}:
+            raise RuntimeError("Archive database is not attached, call attach_archive() first")
+    
+    def archive_requests(self, older_than_days: float, batch_size: int = 500) -> int:
+        """Перенос до batch_size обработанных заявок старше older_than_days дней в архив.
+        
+        В режиме WAL транзакция над несколькими базами не атомарна как целое,
+        поэтому строки сначала копируются в архив (повторное копирование
+        безопасно), и только следующей транзакцией удаляются из основной базы.
+        Возвращает число перенесенных заявок.
+        """
+        age = f'-{float(older_than_days)} days'
+        try:
+            with self._transaction() as cursor:
+                self._require_archive(cursor)
+                cursor.execute(ARCHIVABLE_REQUESTS_SQL, (age, age, batch_size))
+                request_ids = [row[0] for row in cursor.fetchall()]
+                if not request_ids:
+                    return 0
+                placeholders = ', '.join('?' * len(request_ids))
+                cursor.execute('BEGIN')
+                cursor.execute(f'''
+                    INSERT OR IGNORE INTO archive.subscription_requests ({SubscriptionRequest.columns()})
+                    SELECT {SubscriptionRequest.columns()} FROM main.subscription_requests
+                    WHERE id IN ({placeholders})
+                ''', request_ids)
+            with self._transaction() as cursor:
+                cursor.execute(f'''
+                    DELETE FROM main.subscription_requests
+                    WHERE id IN ({placeholders}) AND status IN ('approved', 'rejected')
+                ''', request_ids)
+                return cursor.rowcount
+        except Exception as e:
+            logger.error(f"Error archiving subscription requests: {e}")
+            return 0
+    
+    def compact_ledger(self, older_than_days: float, batch_size: int = 500) -> int:
+        """Сжатие самого старого отрезка журнала звезд (до batch_size строк старше older_than_days дней).
+        
+        Строки копируются в архив, затем одной транзакцией удаляются из
+        stars_balance и заменяются строкой ledger_checkpoints с их итогами,
+        так что баланс и счетчики подарков при сверке не меняются.
+        Возвращает число сжатых строк.
+        """
+        age = f'-{float(older_than_days)} days'
+        try:
+            with self._transaction() as cursor:
+                self._require_archive(cursor)
+                # Отрезок - непрерывное начало журнала по id, где все строки старше older_than_days
+                cursor.execute(LEDGER_HEAD_SQL, (age, batch_size))
+                segment = []
+                for row_id, is_old in cursor.fetchall():
+                    if not is_old:
+                        break
+                    segment.append(row_id)
+                if not segment:
+                    return 0
+                first_id, last_id = segment[0], segment[-1]
+                cursor.execute('BEGIN')
+                cursor.execute(f'''
+                    INSERT OR IGNORE INTO archive.stars_balance ({LedgerEntry.columns()})
+                    SELECT {LedgerEntry.columns()} FROM main.stars_balance WHERE id BETWEEN ? AND ?
+                ''', (first_id, last_id))
+            with self._transaction() as cursor:
+                cursor.execute('BEGIN IMMEDIATE')
+                cursor.execute(f'''
+                    SELECT COUNT(*), {LEDGER_SUMS} FROM main.stars_balance WHERE id BETWEEN ? AND ?
+                ''', (first_id, last_id))
+                rows, balance, gifts_sent, gift_stars_spent = cursor.fetchone()
+                if not rows:
+                    return 0
+                cursor.execute('''
+                    INSERT INTO ledger_checkpoints (first_id, last_id, rows, balance, gifts_sent, gift_stars_spent)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (first_id, last_id, rows, balance, gifts_sent, gift_stars_spent))
+                cursor.execute('DELETE FROM main.stars_balance WHERE id BETWEEN ? AND ?', (first_id, last_id))
+                return rows
+        except Exception as e:
+            logger.error(f"Error compacting stars ledger: {e}")
+            return 0
+    
+    def _schemas(self) -> List[str]:
+        return [row[1] for row in self._conn.execute('PRAGMA database_list') if row[1] != 'temp']
+    
+    def incremental_vacuum(self, pages: int = DEFAULT_VACUUM_PAGES) -> int:
+        """Возврат до pages свободных страниц основной и архивной базы файловой системе.
+        
+        Работает только для баз в режиме auto_vacuum = INCREMENTAL; остальные
+        пропускаются (см. enable_incremental_vacuum). Возвращает число свободных
+        страниц, которые еще можно вернуть (0 - больше нечего).
+        """
+        remaining = 0
+        try:
+            with self._lock:
+                for schema in self._schemas():
+                    if self._conn.execute(f'PRAGMA {schema}.auto_vacuum').fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+                        if schema not in self._vacuum_skipped:
+                            self._vacuum_skipped.add(schema)
+                            logger.warning(f"Schema {schema} is not in incremental auto-vacuum mode, "
+                                           f"free pages are not returned until enable_incremental_vacuum()")
+                        continue
+                    # execute() делает один шаг (одна страница), executescript выполняет прагму до конца
+                    self._conn.executescript(f'PRAGMA {schema}.incremental_vacuum({int(pages)})')
+                    remaining += self._conn.execute(f'PRAGMA {schema}.freelist_count').fetchone()[0]
+            return remaining
+        except Exception as e:
+            logger.error(f"Error running incremental vacuum: {e}")
+            return 0
+    
+    def enable_incremental_vacuum(self) -> bool:
+        """Перевод основной и архивной базы в auto_vacuum = INCREMENTAL.
+        
+        Требует полного VACUUM, который блокирует базу на время перезаписи файла,
+        поэтому выполняется один раз вне часов нагрузки (для новых баз режим
+        включен сразу). Возвращает True, если хотя бы одна база переведена.
+        """
+        self._sync_write_buffer()
+        converted = False
+        with self._lock:
+            for schema in self._schemas():
+                if self._conn.execute(f'PRAGMA {schema}.auto_vacuum').fetchone()[0] == AUTO_VACUUM_INCREMENTAL:
+                    continue
+                self._conn.execute(f'PRAGMA {schema}.auto_vacuum = INCREMENTAL')
+                self._conn.execute(f'VACUUM {schema}')
+                self._vacuum_skipped.discard(schema)
+                logger.info(f"Schema {schema} converted to incremental auto-vacuum")
+                converted = True
+        return converted
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import os
+import socket
+from typing import Dict, Iterable, List
+
+from async_database import AsyncDatabase
+from models import GiftJob
+from sender import MessageScheduler, PRIORITY_USER
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GIFT_PRICE = 1        # звезд за подарок, если не задана настройка gift_price
+DEFAULT_WORKERS = 4
+DEFAULT_BATCH_SIZE = 10
+DEFAULT_LEASE_SECONDS = 60
+DEFAULT_RETRY_DELAY = 60
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_POLL_INTERVAL = 5.0
+
+class GiftDispatcher:
+    """Выдача подарков из таблицы gift_jobs пулом асинхронных воркеров.
+
+    Воркер захватывает пачку заданий с арендой, отправляет gift_message и
+    стикер gift_sticker_id через MessageScheduler, после чего одной
+    транзакцией пишет операцию в журнал звезд, ставит gift_sent и закрывает
+    задание. Пока сообщение ждет в очереди планировщика (в том числе паузу
+    после 429), аренда продлевается каждую треть lease_seconds; если она все
+    же потеряна, доставка отменяется. Задание упавшего воркера возвращается в
+    очередь, когда истекает аренда, а после max_attempts таких возвратов
+    закрывается как failed; повторно может уйти сообщение, но не списание звезд.
+    """
+
+    def __init__(self, db: AsyncDatabase, scheduler: MessageScheduler, workers: int = DEFAULT_WORKERS,
+                 batch_size: int = DEFAULT_BATCH_SIZE, lease_seconds: float = DEFAULT_LEASE_SECONDS,
+                 retry_delay: float = DEFAULT_RETRY_DELAY, max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                 poll_interval: float = DEFAULT_POLL_INTERVAL):
+        self.db = db
+        self.scheduler = scheduler
+        self.workers = workers
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self._owner = f'{socket.gethostname()}-{os.getpid()}'
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self.sent = 0
+        self.failed = 0
+        self.skipped = 0
+
+    async def enqueue(self, user_ids: Iterable[int]) -> int:
+        """Постановка подарков в очередь (цена из настройки gift_price); возвращает число новых заданий"""
+        amount = await self.db.get_int_setting('gift_price', DEFAULT_GIFT_PRICE)
+        added = await self.db.enqueue_gifts(list(user_ids), amount)
+        if added:
+            self._wakeup.set()
+        return added
+
+    def start(self):
+        while len(self._tasks) < self.workers:
+            worker_id = f'{self._owner}-{len(self._tasks)}'
+            self._tasks.append(asyncio.create_task(self._worker(worker_id), name=f'gift-worker-{len(self._tasks)}'))
+
+    async def close(self):
+        """Остановка воркеров; захваченные задания вернутся в очередь по истечении аренды"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _deliver(self, user_id: int):
+        message = await self.db.get_setting('gift_message')
+        sticker_id = await self.db.get_setting('gift_sticker_id')
+        if message:
+            await self.scheduler.send_message(user_id, message, priority=PRIORITY_USER)
+        if sticker_id:
+            await self.scheduler.send_sticker(user_id, sticker_id, priority=PRIORITY_USER)
+
+    async def _hold_lease(self, worker_id: str, job: GiftJob, delivery: asyncio.Task):
+        """Продление аренды во время доставки; при потере аренды доставка отменяется"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            if not await self.db.renew_gift_lease(job.id, worker_id, self.lease_seconds):
+                logger.warning(f"Gift job {job.id} for user {job.user_id}: lease lost, delivery cancelled")
+                delivery.cancel()
+                return
+
+    async def _process(self, worker_id: str, job: GiftJob):
+        # Задание могло дождаться своей очереди в пачке уже после конца аренды
+        if not await self.db.renew_gift_lease(job.id, worker_id, self.lease_seconds):
+            self.skipped += 1
+            return
+        delivery = asyncio.create_task(self._deliver(job.user_id))
+        keeper = asyncio.create_task(self._hold_lease(worker_id, job, delivery))
+        try:
+            await asyncio.wait({delivery})
+        finally:
+            keeper.cancel()
+            delivery.cancel()
+        if delivery.cancelled():
+            self.skipped += 1
+            return
+        error = delivery.exception()
+        if error is not None:
+            self.failed += 1
+            logger.warning(f"Gift job {job.id} for user {job.user_id} failed (attempt {job.attempts}): {error}")
+            await self.db.fail_gift_job(job.id, worker_id, str(error), self.retry_delay, self.max_attempts)
+            return
+        if await self.db.complete_gift_job(job.id, worker_id):
+            self.sent += 1
+        else:
+            self.skipped += 1
+
+    async def _worker(self, worker_id: str):
+        while True:
+            try:
+                jobs = await self.db.claim_gift_jobs(worker_id, self.batch_size, self.lease_seconds,
+                                                     self.max_attempts)
+                if not jobs:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await asyncio.gather(*(self._process(worker_id, job) for job in jobs))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Gift worker {worker_id} error: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    async def get_stats(self) -> Dict[str, int]:
+        """Очередь по статусам и счетчики воркеров этого процесса"""
+        stats = await self.db.get_gift_queue_stats()
+        stats.update(sent=self.sent, failed_attempts=self.failed, skipped=self.skipped)
+        return stats
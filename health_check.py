@@ -10,6 +10,9 @@ import sys
 import logging
 from datetime import datetime, timedelta
 from pathlib import Path
+from typing import Optional
+
+from database import probe_connection
 
 # РќР°СЃС‚СЂРѕР№РєР° Р»РѕРіРёСЂРѕРІР°РЅРёСЏ
 logging.basicConfig(
@@ -19,7 +22,7 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 class BotHealthChecker:
-    def __init__(self, bot_token: str, db_path: str = "bot_database.db"):
+    def __init__(self, bot_token: str, db_path: Optional[str] = None):
         self.bot_token = bot_token
         self.db_path = db_path
         self.api_url = f"https://api.telegram.org/bot{bot_token}"
@@ -43,32 +46,69 @@ class BotHealthChecker:
             logger.error(f"РћС€РёР±РєР° РїРѕРґРєР»СЋС‡РµРЅРёСЏ Рє Telegram API: {e}")
             return False
     
-    def run_health_check(self) -> bool:
+    def check_database(self, max_read_ms: float = 500) -> bool:
+        """Быстрая проверка базы данных: время чтения и PRAGMA quick_check"""
+        if not Path(self.db_path).exists():
+            logger.error(f"База данных не найдена: {self.db_path}")
+            return False
+        try:
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, timeout=2)
+            try:
+                probe = probe_connection(conn)
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка доступа к базе данных: {e}")
+            return False
+        logger.info(f"База данных: чтение {probe['db_read_ms']:.2f} мс, "
+                    f"quick_check {probe['db_quick_check_ms']:.2f} мс ({probe['db_quick_check']})")
+        if not probe['db_ok']:
+            logger.error(f"quick_check вернул ошибку: {probe['db_quick_check']}")
+            return False
+        if probe['db_read_ms'] > max_read_ms:
+            logger.error(f"Чтение из базы слишком медленное: {probe['db_read_ms']:.2f} мс")
+            return False
+        return True
+    
+    def run_health_check(self, check_api: bool = True) -> bool:
         """Р—Р°РїСѓСЃРє РїРѕР»РЅРѕР№ РїСЂРѕРІРµСЂРєРё Р·РґРѕСЂРѕРІСЊСЏ"""
         logger.info("=" * 50)
         logger.info("Р—Р°РїСѓСЃРє РїСЂРѕРІРµСЂРєРё Р·РґРѕСЂРѕРІСЊСЏ Р±РѕС‚Р°")
         logger.info("=" * 50)
         
-        if self.check_telegram_api():
-            logger.info("вњ… Telegram API: OK")
-            return True
-        else:
-            logger.error("вќЊ Telegram API: FAILED")
-            return False
+        healthy = True
+        # База проверяется, только если задан путь к ней (DB_PATH)
+        if self.db_path:
+            if self.check_database():
+                logger.info("✅ База данных: OK")
+            else:
+                logger.error("❌ База данных: FAILED")
+                healthy = False
+        
+        if check_api:
+            if self.check_telegram_api():
+                logger.info("вњ… Telegram API: OK")
+            else:
+                logger.error("вќЊ Telegram API: FAILED")
+                healthy = False
+        return healthy
 
 def main():
     """РћСЃРЅРѕРІРЅР°СЏ С„СѓРЅРєС†РёСЏ"""
     # РџРѕР»СѓС‡Р°РµРј С‚РѕРєРµРЅ Р±РѕС‚Р° РёР· РїРµСЂРµРјРµРЅРЅС‹С… РѕРєСЂСѓР¶РµРЅРёСЏ
     bot_token = os.getenv('BOT_TOKEN')
-    if not bot_token:
+    # --db-only: только быстрая проверка базы (можно запускать каждые несколько секунд)
+    check_api = '--db-only' not in sys.argv
+    db_path = os.getenv('DB_PATH') or (None if check_api else 'bot_database.db')
+    if check_api and not bot_token:
         logger.error("BOT_TOKEN РЅРµ СѓСЃС‚Р°РЅРѕРІР»РµРЅ РІ РїРµСЂРµРјРµРЅРЅС‹С… РѕРєСЂСѓР¶РµРЅРёСЏ")
         sys.exit(1)
     
     # РЎРѕР·РґР°РµРј РїСЂРѕРІРµСЂСЏР»СЊС‰РёРє
-    checker = BotHealthChecker(bot_token)
+    checker = BotHealthChecker(bot_token or '', db_path)
     
     # Р—Р°РїСѓСЃРєР°РµРј РїСЂРѕРІРµСЂРєСѓ
-    success = checker.run_health_check()
+    success = checker.run_health_check(check_api=check_api)
     
     # Р’РѕР·РІСЂР°С‰Р°РµРј РєРѕРґ РІС‹С…РѕРґР°
     sys.exit(0 if success else 1)
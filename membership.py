@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Optional, Tuple
+
+from async_database import AsyncDatabase
+
+logger = logging.getLogger(__name__)
+
+# Статусы участника канала, считающиеся подпиской
+MEMBER_STATUSES = ('creator', 'administrator', 'member')
+
+DEFAULT_TTL = 300            # сколько помнить положительный ответ, с
+DEFAULT_NEGATIVE_TTL = 30    # сколько помнить отрицательный ответ, с
+DEFAULT_MAX_ENTRIES = 100000
+
+def is_member_status(member) -> bool:
+    """Является ли ответ getChatMember подпиской на канал"""
+    status = getattr(member, 'status', None)
+    status = getattr(status, 'value', status)
+    if status in MEMBER_STATUSES:
+        return True
+    # Ограниченный участник остается в канале, если is_member = True
+    return status == 'restricted' and bool(getattr(member, 'is_member', False))
+
+class _LookupAbandoned(Exception):
+    """Задача, выполнявшая общий запрос, отменена - ожидающие повторяют запрос сами"""
+
+class MembershipCache:
+    """Кэш проверок подписки на канал через getChatMember.
+
+    Положительные и отрицательные ответы хранятся разное время (ttl и
+    negative_ttl). Одновременные проверки одного пользователя объединяются в
+    один запрос к Bot API (single-flight). Ошибки API не кэшируются и
+    передаются всем ожидающим.
+    """
+
+    def __init__(self, bot, chat_id: int, ttl: float = DEFAULT_TTL,
+                 negative_ttl: float = DEFAULT_NEGATIVE_TTL, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        # user_id -> (подписан, момент истечения по time.monotonic())
+        self._entries: Dict[int, Tuple[bool, float]] = {}
+        self._inflight: Dict[int, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.api_calls = 0
+
+    async def is_member(self, user_id: int, force: bool = False) -> bool:
+        """Подписан ли пользователь на канал (force - игнорировать кэш)"""
+        if not force:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[1] > time.monotonic():
+                self.hits += 1
+                return entry[0]
+        self.misses += 1
+
+        # Если владелец общего запроса отменен, первый из ожидающих становится новым владельцем
+        while user_id in self._inflight:
+            try:
+                return await asyncio.shield(self._inflight[user_id])
+            except _LookupAbandoned:
+                continue
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[user_id] = future
+        try:
+            self.api_calls += 1
+            member = await self.bot.get_chat_member(chat_id=self.chat_id, user_id=user_id)
+            subscribed = is_member_status(member)
+            self.set(user_id, subscribed)
+            future.set_result(subscribed)
+        except asyncio.CancelledError:
+            # Не отменяем future: ожидающие не отменены и должны получить ответ
+            future.set_exception(_LookupAbandoned())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже передано вызывающему; ожидающих может не быть
+            future.exception()
+            raise
+        finally:
+            del self._inflight[user_id]
+        return subscribed
+
+    def set(self, user_id: int, subscribed: bool):
+        """Запись известного статуса (например, из обновления chat_member)"""
+        ttl = self.ttl if subscribed else self.negative_ttl
+        self._entries[user_id] = (subscribed, time.monotonic() + ttl)
+        if len(self._entries) > self.max_entries:
+            self._evict()
+
+    def invalidate(self, user_id: int):
+        self._entries.pop(user_id, None)
+
+    def _evict(self):
+        now = time.monotonic()
+        for user_id in [uid for uid, (_, expires) in self._entries.items() if expires <= now]:
+            del self._entries[user_id]
+        # Если все записи свежие, удаляем самые старые по порядку добавления
+        overflow = len(self._entries) - self.max_entries
+        for user_id in list(self._entries)[:max(overflow, 0)]:
+            del self._entries[user_id]
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'api_calls': self.api_calls,
+            'inflight': len(self._inflight),
+        }
+
+class SubscriptionVerifier:
+    """Фоновая перепроверка пользователей с is_subscribed = TRUE.
+
+    Пользователи читаются из базы пачками по user_id, проверяются через
+    MembershipCache с ограничением rate_per_second запросов в секунду, а
+    отписавшиеся помечаются через update_user_subscription.
+    """
+
+    def __init__(self, db: AsyncDatabase, cache: MembershipCache, batch_size: int = 20,
+                 rate_per_second: float = 10, interval: float = 6 * 3600):
+        self.db = db
+        self.cache = cache
+        self.batch_size = batch_size
+        self.rate_per_second = rate_per_second
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def _check(self, user_id: int) -> Optional[bool]:
+        try:
+            return await self.cache.is_member(user_id, force=True)
+        except Exception as e:
+            logger.warning(f"Membership check failed for user {user_id}: {e}")
+            return None
+
+    async def run_once(self) -> Dict[str, int]:
+        """Один проход по всем подписанным пользователям"""
+        checked = unsubscribed = errors = 0
+        after_user_id = 0
+        while True:
+            user_ids = await self.db.get_user_ids_page(after_user_id, self.batch_size, is_subscribed=True)
+            if not user_ids:
+                break
+            started = time.monotonic()
+            results = await asyncio.gather(*(self._check(user_id) for user_id in user_ids))
+            for user_id, subscribed in zip(user_ids, results):
+                if subscribed is None:
+                    errors += 1
+                    continue
+                checked += 1
+                if not subscribed:
+                    unsubscribed += 1
+                    await self.db.update_user_subscription(user_id, False)
+            after_user_id = user_ids[-1]
+            # Пачка из batch_size запросов должна занять не меньше batch_size / rate секунд
+            delay = len(user_ids) / self.rate_per_second - (time.monotonic() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        logger.info(f"Subscription verification done: {checked} checked, "
+                    f"{unsubscribed} unsubscribed, {errors} errors")
+        return {'checked': checked, 'unsubscribed': unsubscribed, 'errors': errors}
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Subscription verifier error: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name='subscription-verifier')
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,215 @@
+import asyncio
+import functools
+import inspect
+import logging
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержки, секунды
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+GaugeCallback = Callable[[], Union[float, Awaitable[float]]]
+
+class Histogram:
+    """Гистограмма в формате Prometheus (накопительные корзины, сумма, количество)"""
+    __slots__ = ('buckets', 'counts', 'total', 'count')
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+class MetricsRegistry:
+    """Счетчики, гистограммы и вычисляемые при запросе показатели (gauge)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Tuple], float] = {}
+        self._histograms: Dict[Tuple[str, Tuple], Histogram] = {}
+        self._gauges: Dict[str, Tuple[str, GaugeCallback]] = {}
+        self._help: Dict[str, str] = {}
+
+    @staticmethod
+    def _key(name: str, labels: Optional[Dict[str, str]]) -> Tuple[str, Tuple]:
+        return name, tuple(sorted(labels.items())) if labels else ()
+
+    def describe(self, name: str, help_text: str):
+        self._help[name] = help_text
+
+    def inc(self, name: str, labels: Optional[Dict[str, str]] = None, value: float = 1):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, str]] = None):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def gauge(self, name: str, callback: GaugeCallback, help_text: str = ''):
+        """Показатель, вычисляемый при каждом запросе /metrics (функция или корутина)"""
+        self._gauges[name] = (help_text, callback)
+
+    @staticmethod
+    def _format_labels(labels: Tuple, extra: Tuple = ()) -> str:
+        pairs = labels + extra
+        if not pairs:
+            return ''
+        escaped = (f'{key}="{str(value)}"'.replace('\n', ' ') for key, value in pairs)
+        return '{' + ','.join(escaped) + '}'
+
+    async def render(self) -> str:
+        """Текстовый формат Prometheus"""
+        lines: List[str] = []
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (list(h.counts), h.total, h.count, h.buckets)
+                          for key, h in self._histograms.items()}
+
+        described = set()
+        def header(name: str, kind: str):
+            if name not in described:
+                described.add(name)
+                if name in self._help:
+                    lines.append(f'# HELP {name} {self._help[name]}')
+                lines.append(f'# TYPE {name} {kind}')
+
+        for (name, labels), value in sorted(counters.items()):
+            header(name, 'counter')
+            lines.append(f'{name}{self._format_labels(labels)} {value}')
+        for (name, labels), (counts, total, count, buckets) in sorted(histograms.items()):
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{name}_bucket{self._format_labels(labels, (("le", le),))} {cumulative}')
+            lines.append(f'{name}_sum{self._format_labels(labels)} {total}')
+            lines.append(f'{name}_count{self._format_labels(labels)} {count}')
+        for name, (help_text, callback) in self._gauges.items():
+            try:
+                value = callback()
+                if inspect.isawaitable(value):
+                    value = await value
+            except Exception as e:
+                logger.error(f"Error computing gauge {name}: {e}")
+                continue
+            if help_text:
+                lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {float(value)}')
+        return '\n'.join(lines) + '\n'
+
+def instrument_database(db: Database, registry: MetricsRegistry) -> Database:
+    """Подсчет вызовов и задержки каждого публичного метода экземпляра Database"""
+    registry.describe('bearbot_db_calls_total', 'Database method calls')
+    registry.describe('bearbot_db_call_seconds', 'Database method latency')
+    for name, method in inspect.getmembers(db, inspect.ismethod):
+        if name.startswith('_') or name in ('close', 'flush') or inspect.isgeneratorfunction(method):
+            continue
+
+        def wrap(name: str, method: Callable) -> Callable:
+            labels = {'method': name}
+            @functools.wraps(method)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return method(*args, **kwargs)
+                finally:
+                    registry.inc('bearbot_db_calls_total', labels)
+                    registry.observe('bearbot_db_call_seconds', time.perf_counter() - started, labels)
+            return wrapper
+
+        setattr(db, name, wrap(name, method))
+    return db
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """Middleware aiogram: количество и задержка обработчиков по имени функции"""
+
+    def __init__(self, registry: MetricsRegistry):
+        self.registry = registry
+        registry.describe('bearbot_handler_calls_total', 'Update handler calls')
+        registry.describe('bearbot_handler_seconds', 'Update handler latency')
+
+    async def __call__(self, handler, event, data: Dict[str, Any]) -> Any:
+        handler_object = data.get('handler')
+        callback = getattr(handler_object, 'callback', None)
+        labels = {'handler': getattr(callback, '__name__', type(event).__name__)}
+        started = time.perf_counter()
+        failed = False
+        try:
+            return await handler(event, data)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            labels_with_status = dict(labels, status='error' if failed else 'ok')
+            self.registry.inc('bearbot_handler_calls_total', labels_with_status)
+            self.registry.observe('bearbot_handler_seconds', time.perf_counter() - started, labels)
+
+def add_routes(app: web.Application, registry: MetricsRegistry,
+               health_probe: Optional[Callable[[], Awaitable[Dict[str, Any]]]] = None):
+    """Маршруты /metrics и /healthz (/health - для healthcheckPath в railway.json)"""
+
+    async def metrics_handler(request: web.Request) -> web.Response:
+        return web.Response(text=await registry.render(), content_type='text/plain', charset='utf-8')
+
+    async def health_handler(request: web.Request) -> web.Response:
+        result: Dict[str, Any] = {'status': 'ok'}
+        if health_probe is not None:
+            try:
+                result.update(await asyncio.wait_for(health_probe(), timeout=5))
+                if result.get('db_ok') is False:
+                    result['status'] = 'error'
+            except Exception as e:
+                result.update(status='error', error=str(e))
+        return web.json_response(result, status=200 if result.get('status') == 'ok' else 503)
+
+    app.router.add_get('/metrics', metrics_handler)
+    app.router.add_get('/healthz', health_handler)
+    app.router.add_get('/health', health_handler)
+
+def register_bot_gauges(registry: MetricsRegistry, db, scheduler=None):
+    """Показатели бота: очередь заявок, баланс звезд, очередь отправки.
+
+    db - AsyncDatabase, чтобы запрос /metrics не блокировал цикл событий.
+    """
+    registry.gauge('bearbot_pending_requests', db.count_pending_requests,
+                   'Pending subscription requests')
+    registry.gauge('bearbot_stars_balance', db.get_stars_balance, 'Current stars balance')
+    registry.gauge('bearbot_db_queue_depth', lambda: db.queue_depth, 'AsyncDatabase queue depth')
+    if scheduler is not None:
+        registry.gauge('bearbot_sender_queue_depth', lambda: scheduler.get_metrics()['queue_depth'],
+                       'Outbound message queue depth')
+        registry.gauge('bearbot_sender_latency_p99_seconds',
+                       lambda: scheduler.get_metrics()['latency_p99_ms'] / 1000,
+                       'Outbound message p99 latency')
+
+async def start_metrics_server(registry: MetricsRegistry, health_probe=None,
+                               host: str = '0.0.0.0', port: int = 8080) -> web.AppRunner:
+    """Отдельный HTTP-сервер /metrics и /healthz (для режима polling)"""
+    app = web.Application()
+    add_routes(app, registry, health_probe)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Metrics server listening on {host}:{port}")
+    return runner
@@ -0,0 +1,86 @@
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, Tuple
+
+class Record(Mapping):
+    """Компактная строка таблицы.
+
+    Хранит значения в __slots__ вместо словаря на каждую строку, но сохраняет
+    доступ как к словарю (row['user_id'], row.get(...), dict(row)) для
+    совместимости с кодом, который работал с dict(zip(columns, row)).
+    """
+    __slots__ = ()
+    _fields: Tuple[str, ...] = ()
+    _field_set: frozenset = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._field_set = frozenset(cls._fields)
+
+    def __init__(self, *values):
+        for name, value in zip(self._fields, values):
+            setattr(self, name, value)
+
+    @classmethod
+    def row_factory(cls, cursor, row: Tuple) -> 'Record':
+        """row_factory для sqlite3: строит запись прямо из кортежа строки"""
+        return cls(*row)
+
+    @classmethod
+    def columns(cls) -> str:
+        """Список колонок для SELECT в порядке полей записи"""
+        return ', '.join(cls._fields)
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self._field_set:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._fields)
+
+    def __len__(self) -> int:
+        return len(self._fields)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self._fields}
+
+    def __repr__(self) -> str:
+        values = ', '.join(f'{name}={getattr(self, name)!r}' for name in self._fields)
+        return f'{type(self).__name__}({values})'
+
+class User(Record):
+    """Пользователь бота (таблица users)"""
+    _fields = ('user_id', 'username', 'first_name', 'last_name', 'subscribed_at',
+               'is_subscribed', 'gift_sent', 'created_at')
+    __slots__ = _fields
+
+class SubscriptionRequest(Record):
+    """Заявка на подписку (таблица subscription_requests)"""
+    _fields = ('id', 'user_id', 'username', 'first_name', 'last_name', 'status',
+               'created_at', 'processed_at', 'processed_by')
+    __slots__ = _fields
+
+class LedgerEntry(Record):
+    """Операция в журнале звезд (таблица stars_balance)"""
+    _fields = ('id', 'amount', 'operation_type', 'description', 'user_id', 'gift_type',
+               'created_at')
+    __slots__ = _fields
+
+class BroadcastJob(Record):
+    """Задание рассылки (таблица broadcast_jobs)"""
+    _fields = ('id', 'text', 'is_subscribed', 'gift_sent', 'status', 'last_user_id', 'total',
+               'sent', 'failed', 'created_by', 'created_at', 'started_at', 'updated_at',
+               'finished_at')
+    __slots__ = _fields
+
+class DailyStats(Record):
+    """Дневные итоги (таблица daily_stats)"""
+    _fields = ('day', 'new_users', 'approvals', 'gifts_sent', 'gift_stars_spent')
+    __slots__ = _fields
+
+class GiftJob(Record):
+    """Задание выдачи подарка (таблица gift_jobs)"""
+    _fields = ('id', 'user_id', 'idempotency_key', 'amount', 'gift_type', 'status', 'attempts',
+               'lease_owner', 'lease_until', 'available_at', 'last_error', 'created_at',
+               'updated_at', 'finished_at')
+    __slots__ = _fields
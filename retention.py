@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from async_database import AsyncDatabase
+from database import DEFAULT_VACUUM_PAGES
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REQUEST_DAYS = 30     # обработанные заявки старше - в архив
+DEFAULT_LEDGER_DAYS = 180     # строки журнала звезд старше - сжимаются в контрольные точки
+DEFAULT_BATCH_SIZE = 500
+MIN_BATCH_SIZE = 50
+DEFAULT_BATCH_BUDGET = 0.05   # желаемая длительность одной пачки, с
+DEFAULT_RUN_BUDGET = 30.0     # максимум работы за один проход, с
+DEFAULT_PAUSE = 0.2           # пауза между пачками, с
+
+class RetentionManager:
+    """Фоновый перенос старых данных в архивную базу.
+
+    Раз в interval секунд переносит обработанные заявки и сжимает старые
+    отрезки журнала звезд в контрольные точки, затем возвращает освободившееся
+    место через incremental_vacuum. Вся работа идет маленькими пачками через
+    AsyncDatabase с паузами между ними, поэтому запросы бота ждут не дольше
+    одной пачки. Размер пачки подстраивается под batch_budget, а проход
+    прерывается по run_budget и продолжается в следующий раз.
+
+    incremental_vacuum возвращает место только базам в режиме
+    auto_vacuum = INCREMENTAL; базы, созданные до его включения, нужно один
+    раз перевести полным VACUUM. Это делается либо вручную через
+    Database.enable_incremental_vacuum() при деплое, либо здесь, если задан
+    vacuum_conversion_hours = (с, до) - часы низкой нагрузки по местному времени.
+    """
+
+    def __init__(self, db: AsyncDatabase, archive_path: Optional[str] = None,
+                 request_days: float = DEFAULT_REQUEST_DAYS, ledger_days: float = DEFAULT_LEDGER_DAYS,
+                 batch_size: int = DEFAULT_BATCH_SIZE, batch_budget: float = DEFAULT_BATCH_BUDGET,
+                 run_budget: float = DEFAULT_RUN_BUDGET, pause: float = DEFAULT_PAUSE,
+                 vacuum_pages: int = DEFAULT_VACUUM_PAGES, interval: float = 3600,
+                 vacuum_conversion_hours: Optional[Tuple[int, int]] = None):
+        self.db = db
+        self.archive_path = archive_path
+        self.request_days = request_days
+        self.ledger_days = ledger_days
+        self.batch_size = batch_size
+        self.batch_budget = batch_budget
+        self.run_budget = run_budget
+        self.pause = pause
+        self.vacuum_pages = vacuum_pages
+        self.interval = interval
+        self.vacuum_conversion_hours = vacuum_conversion_hours
+        self._attached = False
+        self._vacuum_checked = False
+        self._task: Optional[asyncio.Task] = None
+
+    async def _drain(self, method: str, days: float, deadline: float) -> int:
+        """Вызовы method пачками, пока есть что переносить и не истек deadline"""
+        total = 0
+        batch_size = self.batch_size
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            moved = await self.db.call(method, days, batch_size)
+            elapsed = time.monotonic() - started
+            total += moved
+            if moved < batch_size:
+                break
+            if elapsed > self.batch_budget:
+                batch_size = max(MIN_BATCH_SIZE, batch_size // 2)
+            elif elapsed < self.batch_budget / 2:
+                batch_size = min(self.batch_size, batch_size * 2)
+            await asyncio.sleep(self.pause)
+        return total
+
+    async def run_once(self) -> Dict[str, int]:
+        """Один проход: архивация заявок, сжатие журнала, incremental vacuum"""
+        if not self._attached:
+            path = await self.db.attach_archive(self.archive_path)
+            self._attached = True
+            logger.info(f"Archive database attached: {path}")
+        deadline = time.monotonic() + self.run_budget
+        requests = await self._drain('archive_requests', self.request_days, deadline)
+        ledger_rows = await self._drain('compact_ledger', self.ledger_days, deadline)
+        converted = False
+        if self._conversion_window() and not self._vacuum_checked:
+            converted = await self.db.enable_incremental_vacuum()
+            self._vacuum_checked = True
+        free_pages = 0
+        while time.monotonic() < deadline:
+            free_pages = await self.db.incremental_vacuum(self.vacuum_pages)
+            if not free_pages:
+                break
+            await asyncio.sleep(self.pause)
+        logger.info(f"Retention pass done: {requests} requests archived, "
+                    f"{ledger_rows} ledger rows compacted, {free_pages} free pages left")
+        return {'requests_archived': requests, 'ledger_rows_compacted': ledger_rows,
+                'free_pages': free_pages, 'vacuum_converted': converted}
+
+    def _conversion_window(self) -> bool:
+        """Сейчас часы, в которые разрешен полный VACUUM для перевода режима"""
+        if self.vacuum_conversion_hours is None:
+            return False
+        start, end = self.vacuum_conversion_hours
+        hour = datetime.now().hour
+        return start <= hour < end if start <= end else hour >= start or hour < end
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Retention error: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name='retention')
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
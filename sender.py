@@ -0,0 +1,274 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты очередей отправки (меньше - важнее)
+PRIORITY_USER = 0        # ответы пользователям
+PRIORITY_ADMIN = 1       # уведомления администраторам
+PRIORITY_BULK = 2        # рассылки
+
+# Ограничения Telegram Bot API
+GLOBAL_RATE = 30         # сообщений в секунду на бота
+PER_CHAT_RATE = 1        # сообщений в секунду в один чат
+MAX_MESSAGE_LENGTH = 4096
+
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_DIGEST_WINDOW = 2.0
+LATENCY_SAMPLES = 1000
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity"""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated_at')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def delay(self) -> float:
+        """Сколько ждать до появления токена (0 - токен есть)"""
+        self._refill(time.monotonic())
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self._refill(time.monotonic())
+        self.tokens -= 1
+
+    @property
+    def is_full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+class _Job:
+    __slots__ = ('chat_id', 'call', 'future', 'enqueued_at', 'attempts')
+
+    def __init__(self, chat_id: int, call: Callable[[], Awaitable[Any]], future: asyncio.Future):
+        self.chat_id = chat_id
+        self.call = call
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+
+class MessageScheduler:
+    """Центральный планировщик исходящих сообщений.
+
+    Все отправки проходят через общую очередь с приоритетами и ограничиваются
+    глобальным ведром токенов и ведром на каждый чат. Ответ 429 (исключение с
+    атрибутом retry_after, например aiogram TelegramRetryAfter) приостанавливает
+    отправку на указанное время, после чего сообщение повторяется.
+    Уведомления администраторам можно объединять в дайджест (notify).
+    """
+
+    def __init__(self, bot, workers: int = DEFAULT_WORKERS, global_rate: float = GLOBAL_RATE,
+                 per_chat_rate: float = PER_CHAT_RATE, max_retries: int = DEFAULT_MAX_RETRIES,
+                 digest_window: float = DEFAULT_DIGEST_WINDOW):
+        self.bot = bot
+        self.workers = workers
+        self.per_chat_rate = per_chat_rate
+        self.max_retries = max_retries
+        self.digest_window = digest_window
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._sequence = itertools.count()
+        self._tasks: List[asyncio.Task] = []
+        self._paused_until = 0.0
+        self._delayed = 0
+        # Дайджесты: chat_id -> накопленные тексты
+        self._digests: Dict[int, List[str]] = {}
+        self._digest_handles: Dict[int, asyncio.TimerHandle] = {}
+        # Метрики
+        self._depth = {PRIORITY_USER: 0, PRIORITY_ADMIN: 0, PRIORITY_BULK: 0}
+        self._latencies: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.coalesced = 0
+
+    def start(self):
+        """Запуск обработчиков очереди"""
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.create_task(self._worker(), name=f'sender-{len(self._tasks)}'))
+
+    async def close(self, drain: bool = True):
+        """Остановка (drain - сначала отправить накопленные дайджесты и очередь)"""
+        if drain and self._queue is not None:
+            for chat_id in list(self._digests):
+                self._flush_digest(chat_id)
+            while True:
+                await self._queue.join()
+                if not self._delayed:
+                    break
+                await asyncio.sleep(0.05)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, chat_id: int, call: Callable[[], Awaitable[Any]],
+               priority: int = PRIORITY_USER) -> asyncio.Future:
+        """Постановка произвольного вызова Bot API в очередь; возвращает future с результатом"""
+        if self._queue is None:
+            self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._put(priority, _Job(chat_id, call, future))
+        return future
+
+    def _put(self, priority: int, job: _Job):
+        self._depth[priority] = self._depth.get(priority, 0) + 1
+        self._queue.put_nowait((priority, next(self._sequence), job))
+
+    async def send_message(self, chat_id: int, text: str, priority: int = PRIORITY_USER, **kwargs) -> Any:
+        """Отправка сообщения через планировщик"""
+        return await self.submit(
+            chat_id, lambda: self.bot.send_message(chat_id=chat_id, text=text, **kwargs), priority)
+
+    async def send_sticker(self, chat_id: int, sticker: str, priority: int = PRIORITY_USER, **kwargs) -> Any:
+        """Отправка стикера через планировщик"""
+        return await self.submit(
+            chat_id, lambda: self.bot.send_sticker(chat_id=chat_id, sticker=sticker, **kwargs), priority)
+
+    def notify(self, chat_id: int, text: str):
+        """Уведомление администратору: сообщения за digest_window секунд объединяются в одно"""
+        if self._queue is None:
+            self.start()
+        self._digests.setdefault(chat_id, []).append(text)
+        if chat_id not in self._digest_handles:
+            self._digest_handles[chat_id] = asyncio.get_running_loop().call_later(
+                self.digest_window, self._flush_digest, chat_id)
+
+    def _flush_digest(self, chat_id: int):
+        handle = self._digest_handles.pop(chat_id, None)
+        if handle is not None:
+            handle.cancel()
+        texts = self._digests.pop(chat_id, [])
+        if not texts:
+            return
+        self.coalesced += len(texts) - 1
+        for text in self._build_digest(texts):
+            self.submit(chat_id, lambda text=text: self.bot.send_message(chat_id=chat_id, text=text),
+                        PRIORITY_ADMIN).add_done_callback(self._log_digest_result)
+
+    @staticmethod
+    def _build_digest(texts: List[str]) -> List[str]:
+        """Склейка уведомлений в сообщения не длиннее лимита Telegram"""
+        if len(texts) == 1:
+            return [texts[0][:MAX_MESSAGE_LENGTH]]
+        separator = '\n\n' + '—' * 10 + '\n\n'
+        header = f'📬 Уведомлений: {len(texts)}\n\n'
+        messages, current = [], header
+        for text in texts:
+            text = text[:MAX_MESSAGE_LENGTH - len(header)]
+            candidate = current + (separator if current != header else '') + text
+            if len(candidate) > MAX_MESSAGE_LENGTH:
+                messages.append(current)
+                candidate = text
+            current = candidate
+        messages.append(current)
+        return messages
+
+    @staticmethod
+    def _log_digest_result(future: asyncio.Future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Error sending admin digest: {future.exception()}")
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 10000:
+                # Полные ведра ничем не отличаются от новых - их можно забыть
+                for key in [key for key, value in self._chat_buckets.items() if value.is_full]:
+                    del self._chat_buckets[key]
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.per_chat_rate, 1)
+        return bucket
+
+    def _requeue_later(self, delay: float, priority: int, job: _Job):
+        self._delayed += 1
+        asyncio.get_running_loop().call_later(delay, self._requeue, priority, job)
+
+    def _requeue(self, priority: int, job: _Job):
+        self._delayed -= 1
+        self._put(priority, job)
+
+    async def _worker(self):
+        while True:
+            priority, _, job = await self._queue.get()
+            self._depth[priority] -= 1
+            try:
+                await self._process(priority, job)
+            except Exception as e:
+                logger.error(f"Sender worker error: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, priority: int, job: _Job):
+        if job.future.done():
+            return
+        # Чат исчерпал лимит - откладываем сообщение, не занимая обработчик
+        chat_bucket = self._chat_bucket(job.chat_id)
+        chat_delay = chat_bucket.delay()
+        if chat_delay > 0:
+            self._requeue_later(chat_delay, priority, job)
+            return
+        chat_bucket.consume()
+        while True:
+            delay = max(self._paused_until - time.monotonic(), self._global_bucket.delay())
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        self._global_bucket.consume()
+
+        job.attempts += 1
+        try:
+            result = await job.call()
+        except Exception as e:
+            retry_after = getattr(e, 'retry_after', None)
+            if retry_after is not None and job.attempts <= self.max_retries:
+                self.retried += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                logger.warning(f"Flood control, retry in {retry_after}s (chat {job.chat_id})")
+                self._requeue_later(retry_after, priority, job)
+                return
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+            return
+        self.sent += 1
+        self._latencies.append(time.monotonic() - job.enqueued_at)
+        if not job.future.done():
+            job.future.set_result(result)
+
+    def get_metrics(self) -> Dict[str, float]:
+        """Глубина очередей по приоритетам и задержка отправки"""
+        latencies = sorted(self._latencies)
+        def percentile(pct: float) -> float:
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(pct / 100 * len(latencies)))]
+        return {
+            'queue_depth': sum(self._depth.values()) + self._delayed,
+            'queue_delayed': self._delayed,
+            'queue_depth_user': self._depth[PRIORITY_USER],
+            'queue_depth_admin': self._depth[PRIORITY_ADMIN],
+            'queue_depth_bulk': self._depth[PRIORITY_BULK],
+            'pending_digests': sum(len(texts) for texts in self._digests.values()),
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+            'coalesced': self.coalesced,
+            'latency_p50_ms': percentile(50) * 1000,
+            'latency_p99_ms': percentile(99) * 1000,
+        }
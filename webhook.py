@@ -0,0 +1,179 @@
+import asyncio
+import hmac
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiogram.webhook.aiohttp_server import setup_application
+
+from metrics import MetricsRegistry, add_routes, start_metrics_server
+
+logger = logging.getLogger(__name__)
+
+# Режим запуска: polling (по умолчанию) или webhook
+RUN_MODE = os.getenv('RUN_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')            # публичный адрес, например https://bot.up.railway.app
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEB_HOST = os.getenv('WEB_HOST', '0.0.0.0')
+WEB_PORT = int(os.getenv('PORT', '8080'))             # Railway передает порт в PORT
+UPDATE_WORKERS = int(os.getenv('UPDATE_WORKERS', '16'))
+UPDATE_QUEUE_SIZE = int(os.getenv('UPDATE_QUEUE_SIZE', '1000'))
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+LATENCY_SAMPLES = 1000
+
+class UpdateQueueHandler:
+    """Прием обновлений Telegram по вебхуку.
+
+    Запрос проверяется по секретному токену и подтверждается сразу, а само
+    обновление кладется в ограниченную очередь, которую разбирают workers
+    обработчиков. Если очередь заполнена, Telegram получает 503 и повторит
+    доставку позже - это и есть обратное давление.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: str = '',
+                 workers: int = UPDATE_WORKERS, max_queue_size: int = UPDATE_QUEUE_SIZE, **data: Any):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.secret_token = secret_token
+        self.workers = workers
+        self.data = data
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self._tasks: List[asyncio.Task] = []
+        self._latencies: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self.received = 0
+        self.rejected = 0
+        self.handled = 0
+        self.errors = 0
+
+    def register(self, app: web.Application, path: str = WEBHOOK_PATH):
+        app.router.add_post(path, self.handle)
+        app.on_startup.append(self._on_startup)
+        app.on_shutdown.append(self._on_shutdown)
+
+    async def _on_startup(self, app: web.Application):
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.create_task(self._worker(), name=f'update-worker-{len(self._tasks)}'))
+
+    async def _on_shutdown(self, app: web.Application):
+        # Дообрабатываем уже подтвержденные обновления - Telegram их больше не пришлет
+        await self._queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _check_secret(self, request: web.Request) -> bool:
+        if not self.secret_token:
+            return True
+        return hmac.compare_digest(request.headers.get(SECRET_HEADER, ''), self.secret_token)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not self._check_secret(request):
+            return web.Response(status=401, text='Unauthorized')
+        try:
+            update = Update.model_validate(await request.json(), context={'bot': self.bot})
+        except Exception as e:
+            logger.warning(f"Malformed update: {e}")
+            return web.Response(status=400, text='Bad Request')
+        try:
+            self._queue.put_nowait((update, time.monotonic()))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return web.Response(status=503, text='Busy')
+        self.received += 1
+        return web.Response(text='ok')
+
+    async def _worker(self):
+        while True:
+            update, received_at = await self._queue.get()
+            try:
+                await self.dispatcher.feed_update(self.bot, update, **self.data)
+                self.handled += 1
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Error handling update {update.update_id}: {e}")
+            finally:
+                self._latencies.append(time.monotonic() - received_at)
+                self._queue.task_done()
+
+    async def join(self):
+        """Ожидание обработки всех принятых обновлений"""
+        await self._queue.join()
+
+    def get_metrics(self) -> Dict[str, float]:
+        """Глубина очереди и задержка от приема до конца обработки"""
+        latencies = sorted(self._latencies)
+        def percentile(pct: float) -> float:
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(pct / 100 * len(latencies)))]
+        return {
+            'queue_depth': self._queue.qsize(),
+            'received': self.received,
+            'rejected': self.rejected,
+            'handled': self.handled,
+            'errors': self.errors,
+            'latency_p50_ms': percentile(50) * 1000,
+            'latency_p99_ms': percentile(99) * 1000,
+        }
+
+def create_app(dispatcher: Dispatcher, bot: Bot, secret_token: str = WEBHOOK_SECRET,
+               path: str = WEBHOOK_PATH, registry: Optional[MetricsRegistry] = None,
+               health_probe=None, **data: Any) -> web.Application:
+    """aiohttp-приложение с обработчиком вебхука (и /metrics, /healthz, если передан registry)"""
+    app = web.Application()
+    handler = UpdateQueueHandler(dispatcher, bot, secret_token, **data)
+    handler.register(app, path)
+    app['update_handler'] = handler
+    if registry is not None:
+        add_routes(app, registry, health_probe)
+        registry.gauge('bearbot_update_queue_depth', lambda: handler.get_metrics()['queue_depth'],
+                       'Webhook update queue depth')
+    setup_application(app, dispatcher, bot=bot, **data)
+    return app
+
+async def run_webhook(dispatcher: Dispatcher, bot: Bot, url: str = WEBHOOK_URL,
+                      host: str = WEB_HOST, port: int = WEB_PORT,
+                      registry: Optional[MetricsRegistry] = None, health_probe=None, **data: Any):
+    """Запуск в режиме вебхука"""
+    if not url:
+        raise RuntimeError("WEBHOOK_URL is required for webhook mode")
+    app = create_app(dispatcher, bot, registry=registry, health_probe=health_probe, **data)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    await bot.set_webhook(url.rstrip('/') + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET or None,
+                          allowed_updates=dispatcher.resolve_used_update_types())
+    logger.info(f"Webhook server listening on {host}:{port}{WEBHOOK_PATH}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await bot.session.close()
+
+async def run(dispatcher: Dispatcher, bot: Bot, mode: Optional[str] = None,
+              registry: Optional[MetricsRegistry] = None, health_probe=None, **data: Any):
+    """Запуск бота в режиме из RUN_MODE (polling или webhook)"""
+    mode = mode or RUN_MODE
+    if mode == 'webhook':
+        await run_webhook(dispatcher, bot, registry=registry, health_probe=health_probe, **data)
+    elif mode == 'polling':
+        metrics_runner = None
+        if registry is not None:
+            metrics_runner = await start_metrics_server(registry, health_probe, WEB_HOST, WEB_PORT)
+        try:
+            await bot.delete_webhook()
+            await dispatcher.start_polling(bot, **data)
+        finally:
+            if metrics_runner is not None:
+                await metrics_runner.cleanup()
+    else:
+        raise ValueError(f"Unknown RUN_MODE: {mode}")